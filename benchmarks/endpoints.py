@@ -0,0 +1,42 @@
+# Per-endpoint framework overhead against the in-process fake backend.
+#
+#   python benchmarks/endpoints.py --iterations 2000
+#   VBOX_SERVER__INTERNAL_VALIDATION=off python benchmarks/endpoints.py
+import argparse
+import asyncio
+import harness
+
+
+async def run(iterations: int) -> None:
+    import main
+    async with harness.AsgiClient(app = main.app).lifespan() as client:
+        vm_uuid = (await client.json('POST', '/api/v1/machine', body = harness.BENCH_MACHINE))['payload']
+        scenarios = {
+            'GET /ping': lambda: client.json('GET', '/ping'),
+            'GET /api/v1/machine': lambda: client.json('GET', '/api/v1/machine'),
+            'GET /api/v1/machine (no-cache)': lambda: client.json('GET', '/api/v1/machine', headers = {'Cache-Control': 'no-cache'}),
+            'GET /api/v1/machine/info': lambda: client.json('GET', '/api/v1/machine/info'),
+            'GET /api/v1/machine/{uuid}': lambda: client.json('GET', f'/api/v1/machine/{vm_uuid}'),
+            'GET /api/v1/machine/{uuid} (no-cache)': lambda: client.json('GET', f'/api/v1/machine/{vm_uuid}', headers = {'Cache-Control': 'no-cache'}),
+            'POST /api/v1/machine/{uuid}/start': lambda: client.json('POST', f'/api/v1/machine/{vm_uuid}/start'),
+            'POST /api/v1/machine/{uuid}/stop': lambda: client.json('POST', f'/api/v1/machine/{vm_uuid}/stop'),
+            'POST /api/v1/machine': lambda: client.json('POST', '/api/v1/machine', body = harness.BENCH_MACHINE),
+            'GET /api/v1/config': lambda: client.json('GET', '/api/v1/config'),
+            'GET /api/v1/config/{name}': lambda: client.json('GET', '/api/v1/config/bench'),
+            'GET /api/v1/image': lambda: client.json('GET', '/api/v1/image'),
+        }
+        print(harness.LatencyStats.header())
+        for (name, call) in scenarios.items():
+            stats = harness.LatencyStats(name = name)
+            for _ in range(iterations // 10):
+                await call()
+            for _ in range(iterations):
+                await harness.measure(stats = stats, call = call)
+            print(stats.row())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'per-endpoint latency of the server against the fake VirtualBox backend')
+    parser.add_argument('--iterations', type = int, default = 1000)
+    arguments = parser.parse_args()
+    harness.prepare_environment()
+    asyncio.run(run(iterations = arguments.iterations))
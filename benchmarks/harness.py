@@ -0,0 +1,103 @@
+import contextlib
+import statistics
+import tempfile
+import asyncio
+import typing
+import json
+import time
+import sys
+import os
+
+SOURCES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+def prepare_environment(**overrides: str) -> None:
+    # scratch directories and the in-process fake backend unless the caller passes its own values, must run before `main` is imported,
+    # the variables of the shell are replaced so a benchmark never creates machines on a real host or writes into its directories
+    base_dir = tempfile.mkdtemp(prefix = 'vbox-server-bench-')
+    for name in ('machines', 'storages', 'configs', 'images'):
+        os.makedirs(os.path.join(base_dir, name), exist_ok = True)
+        os.environ[f'VBOX_SERVER__{name.upper()}_DIR'] = os.path.join(base_dir, name)
+    os.environ['VBOX_SERVER__JOBS_DATABASE'] = os.path.join(base_dir, 'jobs.sqlite3')
+    os.environ['VBOX_SERVER__ADVERTISED_HOST'] = '127.0.0.1'
+    os.environ['VBOX_SERVER__VBOX_BACKEND'] = 'fake'
+    for name in ('VBOX_SERVER__VBOXMANAGE_BIN', 'VBOX_SERVER__HOSTS', 'VBOX_SERVER__POOLS', 'VBOX_SERVER__DEFAULT_POOL'):
+        os.environ.pop(name, None)
+    os.environ.update(overrides)
+    with open(os.path.join(os.environ['VBOX_SERVER__CONFIGS_DIR'], 'bench.json'), mode = 'w') as config_file:
+        json.dump(BENCH_MACHINE, config_file)
+    with open(os.path.join(os.environ['VBOX_SERVER__IMAGES_DIR'], 'bench.iso'), mode = 'wb') as image_file:
+        image_file.write(b'\0' * 4096)
+    if SOURCES_DIR not in sys.path:
+        sys.path.insert(0, SOURCES_DIR)
+
+BENCH_MACHINE: dict[str, typing.Any] = {
+    'os_type': 'Linux_64', 'template': 'bench',
+    'drive': {'size_gb': 1}, 'hardware': {'cpu_count': 1, 'memory_mb': 128, 'vram_mb': 16},
+    'vrde_credentials': {'username': 'bench', 'password': 'benchmark'},
+}
+
+
+class AsgiClient:
+    # drives the ASGI application in-process, so only the framework and the server code are measured
+    def __init__(self, app: typing.Any) -> None:
+        self.__app = app
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self) -> typing.AsyncIterator['AsgiClient']:
+        async with self.__app.router.lifespan_context(self.__app):
+            yield self
+
+    async def request(self, method: str, path: str, body: typing.Any = None, headers: dict[str, str] | None = None) -> tuple[int, bytes]:
+        (path, _, query) = path.partition('?')
+        raw_body = json.dumps(body).encode() if body is not None else b''
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+            'headers': [(b'host', b'bench'), (b'content-type', b'application/json'), (b'content-length', str(len(raw_body)).encode())] + [(key.lower().encode(), value.encode()) for (key, value) in (headers or dict()).items()],
+            'client': ('127.0.0.1', 0), 'server': ('bench', 80),
+        }
+        messages = [{'type': 'http.request', 'body': raw_body, 'more_body': False}]
+        response: dict[str, typing.Any] = {'status': 0, 'body': bytearray()}
+        async def receive() -> dict[str, typing.Any]:
+            if messages:
+                return messages.pop(0)
+            await asyncio.Event().wait()
+        async def send(message: dict[str, typing.Any]) -> None:
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['body'] += message.get('body', b'')
+        await self.__app(scope, receive, send)
+        return (response['status'], bytes(response['body']))
+    async def json(self, method: str, path: str, body: typing.Any = None, headers: dict[str, str] | None = None) -> typing.Any:
+        (status, raw_body) = await self.request(method = method, path = path, body = body, headers = headers)
+        if status >= 400:
+            raise RuntimeError(f'{method} {path} -> {status}: {raw_body[:200]!r}')
+        return json.loads(raw_body)
+
+
+class LatencyStats:
+    def __init__(self, name: str) -> None:
+        self.name: str = name
+        self.samples_s: list[float] = []
+        self.errors: int = 0
+
+    def percentile(self, percent: float) -> float:
+        ordered = sorted(self.samples_s)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))] if ordered else 0
+    def row(self, elapsed_s: float | None = None) -> str:
+        mean_us = statistics.fmean(self.samples_s) * 1e6 if self.samples_s else 0
+        throughput = f'{len(self.samples_s) / elapsed_s:>10.1f}' if elapsed_s else f'{"-":>10}'
+        return f'{self.name:<44}{len(self.samples_s):>8}{self.errors:>7}{throughput}{mean_us:>12.1f}{self.percentile(50) * 1e6:>12.1f}{self.percentile(99) * 1e6:>12.1f}'
+    @staticmethod
+    def header() -> str:
+        return f'{"endpoint":<44}{"count":>8}{"errors":>7}{"req/s":>10}{"mean us":>12}{"p50 us":>12}{"p99 us":>12}'
+
+async def measure(stats: LatencyStats, call: typing.Callable[[], typing.Awaitable[typing.Any]]) -> None:
+    started_at = time.perf_counter()
+    try:
+        await call()
+    except Exception:
+        stats.errors += 1
+        return
+    stats.samples_s.append(time.perf_counter() - started_at)
@@ -0,0 +1,104 @@
+# Throughput and latency per endpoint under concurrent clients.
+#
+#   python benchmarks/load.py --clients 32 --duration 10
+#   python benchmarks/load.py --backend simulator --latency-ms '{"default": 20, "createhd": 500}' --failure-rate 0.01
+#
+# The fake backend measures the server itself, the simulator spawns a process per VBoxManage call like production does.
+import argparse
+import tempfile
+import asyncio
+import random
+import typing
+import shlex
+import json
+import time
+import sys
+import os
+import harness
+
+SIMULATOR_BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vboxmanage_simulator.py')
+
+# relative weights of what a client does next, every client works on a machine of its own
+SCENARIOS: dict[str, int] = {
+    'GET /api/v1/machine': 30,
+    'GET /api/v1/machine/info': 15,
+    'GET /api/v1/machine/{uuid}': 30,
+    'GET /api/v1/machine/{uuid} (no-cache)': 5,
+    'POST /api/v1/machine/{uuid}/start+stop': 10,
+    'POST+DELETE /api/v1/machine': 5,
+    'GET /metrics': 5,
+}
+
+
+async def run_client(client: harness.AsgiClient, stats: dict[str, harness.LatencyStats], vm_uuid: str, deadline: float, seed: int) -> None:
+    generator = random.Random(seed)
+    async def start_stop() -> None:
+        await client.json('POST', f'/api/v1/machine/{vm_uuid}/start')
+        await client.json('POST', f'/api/v1/machine/{vm_uuid}/stop')
+    async def create_delete() -> None:
+        created_uuid = (await client.json('POST', '/api/v1/machine', body = harness.BENCH_MACHINE))['payload']
+        await client.json('DELETE', f'/api/v1/machine/{created_uuid}')
+    calls: dict[str, typing.Callable[[], typing.Awaitable[typing.Any]]] = {
+        'GET /api/v1/machine': lambda: client.json('GET', '/api/v1/machine'),
+        'GET /api/v1/machine/info': lambda: client.json('GET', '/api/v1/machine/info'),
+        'GET /api/v1/machine/{uuid}': lambda: client.json('GET', f'/api/v1/machine/{vm_uuid}'),
+        'GET /api/v1/machine/{uuid} (no-cache)': lambda: client.json('GET', f'/api/v1/machine/{vm_uuid}', headers = {'Cache-Control': 'no-cache'}),
+        'POST /api/v1/machine/{uuid}/start+stop': start_stop,
+        'POST+DELETE /api/v1/machine': create_delete,
+        'GET /metrics': lambda: client.request('GET', '/metrics'),
+    }
+    while time.perf_counter() < deadline:
+        name = generator.choices(list(SCENARIOS), weights = list(SCENARIOS.values()))[0]
+        await harness.measure(stats = stats[name], call = calls[name])
+
+async def create_machine(client: harness.AsgiClient, attempts: int = 5) -> str:
+    # injected failures may hit the setup too, only the measured calls count them
+    for _ in range(attempts):
+        (status, raw_body) = await client.request('POST', '/api/v1/machine', body = harness.BENCH_MACHINE)
+        if status == 200:
+            return json.loads(raw_body)['payload']
+    raise RuntimeError(f'creating a machine failed {attempts} times, last response {status}: {raw_body[:500]!r}')
+
+def write_simulator_wrapper(directory: str) -> str:
+    # the simulator runs with this interpreter, its shebang would pick whatever python3 comes first on PATH
+    wrapper_path = os.path.join(directory, 'VBoxManage')
+    with open(wrapper_path, mode = 'w') as wrapper_file:
+        wrapper_file.write(f'#!/bin/sh\nexec {shlex.quote(sys.executable)} {shlex.quote(SIMULATOR_BIN)} "$@"\n')
+    os.chmod(wrapper_path, 0o755)
+    return wrapper_path
+
+async def run(clients: int, duration_s: float) -> None:
+    import main
+    async with harness.AsgiClient(app = main.app).lifespan() as client:
+        stats = {name: harness.LatencyStats(name = name) for name in SCENARIOS}
+        vm_uuids = await asyncio.gather(*(create_machine(client = client) for _ in range(clients)))
+        started_at = time.perf_counter()
+        await asyncio.gather(*(run_client(client = client, stats = stats, vm_uuid = vm_uuid, deadline = started_at + duration_s, seed = seed) for (seed, vm_uuid) in enumerate(vm_uuids)))
+        elapsed_s = time.perf_counter() - started_at
+        await asyncio.gather(*(client.request('DELETE', f'/api/v1/machine/{vm_uuid}') for vm_uuid in vm_uuids))
+        print(harness.LatencyStats.header())
+        for name in SCENARIOS:
+            print(stats[name].row(elapsed_s = elapsed_s))
+        total = harness.LatencyStats(name = 'total')
+        for endpoint_stats in stats.values():
+            total.samples_s += endpoint_stats.samples_s
+            total.errors += endpoint_stats.errors
+        print(total.row(elapsed_s = elapsed_s))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'per-endpoint throughput and latency of the server under concurrent clients')
+    parser.add_argument('--clients', type = int, default = 16)
+    parser.add_argument('--duration', type = float, default = 10, help = 'seconds')
+    parser.add_argument('--backend', choices = ('fake', 'simulator'), default = 'fake')
+    parser.add_argument('--latency-ms', default = '0', help = 'simulator latency, a number or a JSON object per subcommand')
+    parser.add_argument('--failure-rate', default = '0', help = 'simulator failure rate, a number or a JSON object per subcommand')
+    arguments = parser.parse_args()
+    if arguments.backend == 'simulator':
+        simulator_dir = tempfile.mkdtemp(prefix = 'vbox-simulator-')
+        os.environ['VBOX_SIMULATOR__STATE'] = os.path.join(simulator_dir, 'state.json')
+        os.environ['VBOX_SIMULATOR__LATENCY_MS'] = arguments.latency_ms
+        os.environ['VBOX_SIMULATOR__FAILURE_RATE'] = arguments.failure_rate
+        harness.prepare_environment(VBOX_SERVER__VBOX_BACKEND = 'subprocess', VBOX_SERVER__VBOXMANAGE_BIN = write_simulator_wrapper(directory = simulator_dir))
+    else:
+        harness.prepare_environment()
+    asyncio.run(run(clients = arguments.clients, duration_s = arguments.duration))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Drop-in stand-in for the VBoxManage executable, backed by the fake backend with its state kept in a JSON file.
+#
+#   VBOX_SERVER__VBOXMANAGE_BIN=benchmarks/vboxmanage_simulator.py
+#   VBOX_SIMULATOR__STATE=/tmp/vbox-simulator.json         state file, shared by every call
+#   VBOX_SIMULATOR__LATENCY_MS=50                           or per subcommand: '{"default": 20, "createhd": 800}'
+#   VBOX_SIMULATOR__FAILURE_RATE=0.01                       or per subcommand: '{"startvm": 0.1}'
+#   VBOX_SIMULATOR__SEED=1                                  makes injected failures reproducible
+import tempfile
+import random
+import fcntl
+import json
+import time
+import sys
+import os
+
+SOURCES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if SOURCES_DIR not in sys.path:
+    sys.path.insert(0, SOURCES_DIR)
+# every call is a fresh interpreter, skip the validation wrappers to keep the startup closer to the real binary
+os.environ['VBOX_SERVER__INTERNAL_VALIDATION'] = 'off'
+
+from domain.machines.backends.fake import FakeVBoxManageBackend
+
+
+def per_subcommand(name: str, subcommand: str) -> float:
+    # a plain number applies to every subcommand, an object may override it per subcommand
+    value = json.loads(os.environ.get(name, '0'))
+    if isinstance(value, dict):
+        return float(value.get(subcommand, value.get('default', 0)))
+    return float(value)
+
+def load_state(path: str) -> dict:
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return dict()
+
+def save_state(path: str, state: dict) -> None:
+    # written aside and renamed, a reader never sees a half written file
+    (descriptor, temporary_path) = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(path)), prefix = '.vbox-simulator-')
+    with os.fdopen(descriptor, mode = 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(temporary_path, path)
+
+def main(args: list[str]) -> int:
+    state_path = os.environ.get('VBOX_SIMULATOR__STATE', os.path.join(tempfile.gettempdir(), 'vbox-simulator.json'))
+    subcommand = next((arg for arg in args if not arg.startswith('--')), '')
+    if 'VBOX_SIMULATOR__SEED' in os.environ:
+        random.seed(f'{os.environ['VBOX_SIMULATOR__SEED']}:{' '.join(args)}')
+    # the latency is spent outside of the state lock, so concurrent calls overlap like real ones do
+    time.sleep(per_subcommand(name = 'VBOX_SIMULATOR__LATENCY_MS', subcommand = subcommand) / 1000)
+    if random.random() < per_subcommand(name = 'VBOX_SIMULATOR__FAILURE_RATE', subcommand = subcommand):
+        sys.stderr.write(f'VBoxManage: error: injected failure of \'{subcommand}\'\n')
+        return 1
+    with open(f'{state_path}.lock', mode = 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        backend = FakeVBoxManageBackend(state = load_state(path = state_path))
+        result = backend.execute(args = args)
+        if result.status == 0 and subcommand not in ('list', 'showvminfo', 'guestcontrol'):
+            save_state(path = state_path, state = backend.state)
+    sys.stdout.write(result.stdout)
+    sys.stderr.write(result.stderr)
+    return result.status
+
+if __name__ == '__main__':
+    sys.exit(main(args = sys.argv[1:]))
@@ -1,5 +1,8 @@
-from domain.configs.models import ConfigFile, ConfigName
+from domain.configs.models import ConfigFile, ConfigName, ConfigInfo
 from domain.machines.models import CreateMachineInfo
+from domain.indexes import DirectoryIndex
+from domain.validation import validate_call
+import hashlib
 import pydantic
 import json
 import abc
@@ -7,27 +10,53 @@ import os
 
 class AbstractConfigRepository(abc.ABC):
     @abc.abstractmethod
-    @pydantic.validate_call(validate_return = True)
+    @validate_call(validate_return = True)
     def list_configs(self) -> list[ConfigName]:
         raise NotImplementedError(f'{type(self)}.list_configs')
     @abc.abstractmethod
-    @pydantic.validate_call(validate_return = True)
+    @validate_call(validate_return = True)
+    def list_config_infos(self) -> list[ConfigInfo]:
+        raise NotImplementedError(f'{type(self)}.list_config_infos')
+    @abc.abstractmethod
+    @validate_call(validate_return = True)
     def load_config(self, config: ConfigName) -> CreateMachineInfo:
         raise NotImplementedError(f'{type(self)}.load_config')
+    @validate_call(validate_return = True)
+    def close(self) -> None:
+        pass
 
 class LocalConfigRepository(AbstractConfigRepository):
-    @pydantic.validate_call(validate_return = True)
-    def __init__(self, configs_dir: str) -> None:
+    CONFIG_FILE_ADAPTER = pydantic.TypeAdapter(ConfigFile)
+
+    @validate_call(validate_return = True)
+    def __init__(self, configs_dir: str, refresh_interval_s: pydantic.NonNegativeFloat = 1) -> None:
         self.__configs_dir: str = configs_dir
-    @pydantic.validate_call(validate_return = True)
+        self.__index: DirectoryIndex[tuple[ConfigInfo, CreateMachineInfo | None]] = DirectoryIndex(directory = configs_dir, build_entry = self.__build_entry, refresh_interval_s = refresh_interval_s)
+    def __build_entry(self, filename: str, path: str, stat: os.stat_result) -> tuple[ConfigInfo, CreateMachineInfo | None] | None:
+        try:
+            self.CONFIG_FILE_ADAPTER.validate_python(filename)
+        except pydantic.ValidationError:
+            return None
+        with open(file = path, mode = 'rb') as config_file:
+            content = config_file.read()
+        config_info = ConfigInfo(name = filename[0:-5], size_bytes = len(content), sha256 = hashlib.sha256(content).hexdigest())
+        try:
+            return (config_info, CreateMachineInfo.model_validate_json(content))
+        except pydantic.ValidationError as error:
+            config_info.error = str(error)
+            return (config_info, None)
+    @validate_call(validate_return = True)
     def list_configs(self) -> list[ConfigName]:
-        configs: list[ConfigName] = []
-        for filename in os.listdir(self.__configs_dir):
-            try:
-                configs.append(pydantic.RootModel[ConfigName](root = pydantic.RootModel[ConfigFile](root = filename).root[0:-5]).root)
-            except Exception:
-                pass
-        return configs
-    @pydantic.validate_call(validate_return = True)
+        return [config_info.name for (config_info, _) in self.__index.entries().values()]
+    @validate_call(validate_return = True)
+    def list_config_infos(self) -> list[ConfigInfo]:
+        return [config_info.model_copy() for (config_info, _) in self.__index.entries().values()]
+    @validate_call(validate_return = True)
     def load_config(self, config: ConfigName) -> CreateMachineInfo:
+        if (entry := self.__index.entries().get(f'{config}.json')) is not None and entry[1] is not None:
+            return entry[1].model_copy(deep = True)
+        # unknown or broken configs are read directly, so the caller gets the original error
         return CreateMachineInfo.model_validate(obj = json.load(open(file = f'{self.__configs_dir}/{config}.json', mode = 'r')))
+    @validate_call(validate_return = True)
+    def close(self) -> None:
+        self.__index.close()
@@ -2,3 +2,9 @@ import pydantic
 
 ConfigFile = pydantic.constr(pattern = r'^[a-zA-Z0-9](?:[a-zA-Z0-9_-]|\.?[a-zA-Z0-9_-])*\.json$')
 ConfigName = pydantic.constr(pattern = r'^[a-zA-Z0-9](?:[a-zA-Z0-9_-]|\.?[a-zA-Z0-9_-])*$')
+
+class ConfigInfo(pydantic.BaseModel):
+    name: ConfigName # type: ignore
+    size_bytes: pydantic.NonNegativeInt
+    sha256: str
+    error: str | None = None
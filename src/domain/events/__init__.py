@@ -0,0 +1,124 @@
+from domain.events.models import MachineStateEvent
+from domain.machines import VirtualBoxApi
+from domain.hosts import HostRegistry
+from domain.validation import validate_call
+import contextlib
+import pydantic
+import asyncio
+import logging
+import typing
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class MachineStateWatcher:
+    # one `list vms --long` per interval serves every subscriber, instead of a `showvminfo` per client poll
+    @validate_call(config = pydantic.ConfigDict(arbitrary_types_allowed = True), validate_return = True)
+    def __init__(self, vbox_api: VirtualBoxApi | HostRegistry, interval_s: pydantic.PositiveFloat = 1, queue_size: pydantic.PositiveInt = 256) -> None:
+        self.__vbox_api: VirtualBoxApi | HostRegistry = vbox_api
+        self.__interval_s: float = interval_s
+        self.__queue_size: int = queue_size
+        # `None` until the first listing after the watcher was idle, there is nothing to diff against then
+        self.__states: dict[uuid.UUID, str] | None = None
+        self.__observed_at: float = 0
+        # each subscriber receives the events of a single machine or of all of them, a `None` item ends the subscription
+        self.__subscribers: dict[asyncio.Queue[MachineStateEvent | None], uuid.UUID | None] = dict()
+        self.__awaiting_snapshot: set[asyncio.Queue[MachineStateEvent | None]] = set()
+        self.__wanted: asyncio.Event = asyncio.Event()
+        self.__task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        self.__task = asyncio.create_task(self.__run())
+    async def stop(self) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+            await asyncio.gather(self.__task, return_exceptions = True)
+            self.__task = None
+        for queue in list(self.__subscribers):
+            self.__close(queue = queue)
+
+    async def subscribe(self, vm_uuid: uuid.UUID | None = None) -> typing.AsyncIterator[MachineStateEvent]:
+        # the current state comes first, so a subscriber never misses a change made between a lookup and the subscription
+        queue: asyncio.Queue[MachineStateEvent | None] = asyncio.Queue(maxsize = self.__queue_size)
+        self.__subscribers[queue] = vm_uuid
+        if self.__states is not None:
+            for event in self.__snapshot(vm_uuid = vm_uuid):
+                self.__deliver(queue = queue, event = event)
+        else:
+            self.__awaiting_snapshot.add(queue)
+        self.__wanted.set()
+        try:
+            while (event := await queue.get()) is not None:
+                yield event
+        finally:
+            self.__subscribers.pop(queue, None)
+            self.__awaiting_snapshot.discard(queue)
+    @validate_call(validate_return = True)
+    async def wait_for_state(self, vm_uuid: uuid.UUID, states: set[str] | None, timeout_s: pydantic.NonNegativeFloat) -> MachineStateEvent:
+        # long polling, returns once the machine is in one of `states` (any other state than the current one for `None`),
+        # once it is gone, or with its last known state after the timeout
+        last_event: MachineStateEvent | None = None
+        with contextlib.suppress(TimeoutError):
+            async with asyncio.timeout(timeout_s):
+                async with contextlib.aclosing(self.subscribe(vm_uuid = vm_uuid)) as events:
+                    async for event in events:
+                        changed = states is None and last_event is not None
+                        last_event = event
+                        if event.state is None or changed or (states is not None and event.state in states):
+                            break
+        if last_event is None:
+            # the timeout ran out before the first listing, a single lookup answers instead
+            vm_info = (await self.__vbox_api.vm_info(vm_uuid = vm_uuid)).payload
+            return MachineStateEvent(vm_uuid = vm_uuid, state = vm_info.state, observed_at = time.time())
+        return last_event
+
+    async def __run(self) -> None:
+        while True:
+            if not self.__subscribers:
+                # nobody listens, the known states go stale and are not worth a VBoxManage call
+                self.__states = None
+                self.__wanted.clear()
+                await self.__wanted.wait()
+            try:
+                listing = (await self.__vbox_api.list_vms_info(use_cache = False)).payload
+            except Exception:
+                logger.warning('listing the machines for the state watcher failed', exc_info = True)
+            else:
+                self.__publish(states = {vm_uuid: vm_info.state for (vm_uuid, vm_info) in listing.items()}, observed_at = time.time())
+            await asyncio.sleep(self.__interval_s)
+    def __publish(self, states: dict[uuid.UUID, str], observed_at: float) -> None:
+        changes: list[MachineStateEvent] = []
+        if self.__states is not None:
+            changes = [
+                MachineStateEvent(vm_uuid = vm_uuid, previous_state = self.__states.get(vm_uuid), state = states.get(vm_uuid), observed_at = observed_at)
+                for vm_uuid in self.__states.keys() | states.keys() if self.__states.get(vm_uuid) != states.get(vm_uuid)
+            ]
+        (self.__states, self.__observed_at) = (states, observed_at)
+        for (queue, vm_uuid) in list(self.__subscribers.items()):
+            if queue in self.__awaiting_snapshot:
+                events = self.__snapshot(vm_uuid = vm_uuid)
+            else:
+                events = [event for event in changes if vm_uuid is None or event.vm_uuid == vm_uuid]
+            for event in events:
+                self.__deliver(queue = queue, event = event)
+        self.__awaiting_snapshot.clear()
+    def __snapshot(self, vm_uuid: uuid.UUID | None) -> list[MachineStateEvent]:
+        if vm_uuid is not None:
+            # a missing machine is reported as well, a subscriber waiting for it would wait forever otherwise
+            return [MachineStateEvent(vm_uuid = vm_uuid, state = self.__states.get(vm_uuid), observed_at = self.__observed_at)]
+        return [MachineStateEvent(vm_uuid = vm_uuid, state = state, observed_at = self.__observed_at) for (vm_uuid, state) in self.__states.items()]
+    def __deliver(self, queue: asyncio.Queue[MachineStateEvent | None], event: MachineStateEvent) -> None:
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # a subscriber which does not keep up is dropped rather than buffered without bound, it resubscribes for a fresh snapshot
+            logger.warning('a machine state subscriber fell %d events behind and is dropped', queue.qsize())
+            self.__close(queue = queue)
+    def __close(self, queue: asyncio.Queue[MachineStateEvent | None]) -> None:
+        self.__subscribers.pop(queue, None)
+        self.__awaiting_snapshot.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
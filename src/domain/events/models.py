@@ -0,0 +1,10 @@
+import pydantic
+import uuid
+
+class MachineStateEvent(pydantic.BaseModel):
+    vm_uuid: uuid.UUID
+    # `None` before the first time a subscriber is told about the machine and once the machine is gone
+    previous_state: str | None = None
+    state: str | None = None
+    # when the listing that observed the state was taken
+    observed_at: float
@@ -0,0 +1,200 @@
+from domain.machines.models import RunVmCommand, VBoxManageOutputEvent, VirtualBoxApiResponse, VrdeConnectionInfo, CreateMachineInfo, FullMachineInfo, HardDiskInfo
+from domain.hosts.models import HostName, HostCapacity, HostUsage, HostInfo, NoCapacityError
+from domain.machines import VirtualBoxApi
+from domain.validation import validate_call
+import contextlib
+import pydantic
+import asyncio
+import logging
+import typing
+import math
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# merged listings get an id derived from the per host ones, so a merge of cached listings is still recorded once
+MERGED_OPERATIONS_NAMESPACE: uuid.UUID = uuid.UUID('5a0b7c52-52d6-4c1e-9d0c-6f1b8e2f4a31')
+
+
+class HostRegistry:
+    # the public interface of VirtualBoxApi spread over several hosts, one VirtualBoxApi per host
+    @validate_call(config = pydantic.ConfigDict(arbitrary_types_allowed = True), validate_return = True)
+    def __init__(self, hosts: dict[HostName, VirtualBoxApi], capacities: dict[HostName, HostCapacity]) -> None:
+        if len(hosts) == 0 or hosts.keys() != capacities.keys():
+            raise ValueError('every host needs a capacity and at least one host is required')
+        self.__hosts: dict[str, VirtualBoxApi] = hosts
+        self.__capacities: dict[str, HostCapacity] = capacities
+        self.__owners: dict[uuid.UUID, str] = dict()
+        # the last listing of every host, the machines of a host which can not be reached are reported from it in the `unknown` state
+        self.__last_listings: dict[str, dict[uuid.UUID, FullMachineInfo]] = dict()
+        # disk usage of every host as of its last inspection, in GB
+        self.__disk_usage: dict[str, int] = dict()
+        # machines being created are not listed yet, their resources are held here until they are
+        self.__pending: dict[str, HostUsage] = {name: HostUsage() for name in hosts}
+        self.__placement_lock: asyncio.Lock = asyncio.Lock()
+
+    @validate_call(validate_return = True)
+    async def list_hosts(self) -> list[HostInfo]:
+        names = list(self.__hosts)
+        results = await asyncio.gather(*(self.__inspect_host(name = name, use_cache = True) for name in names), return_exceptions = True)
+        hosts: list[HostInfo] = []
+        for (name, result) in zip(names, results):
+            if isinstance(result, Exception):
+                # an unreachable host is reported with what was last known of it
+                logger.warning('host %s is reported as unreachable, inspecting it failed', name, exc_info = result)
+                (machines, reachable) = (self.__last_known_machines(name = name), False)
+            else:
+                (machines, reachable) = (result, True)
+            hosts.append(HostInfo(
+                name = name, advertised_host = self.__hosts[name].advertised_host, capacity = self.__capacities[name],
+                usage = self.__usage(name = name, machines = machines), machines = len(machines), reachable = reachable,
+            ))
+        return hosts
+
+    async def __host_of(self, vm_uuid: uuid.UUID) -> VirtualBoxApi:
+        if vm_uuid not in self.__owners:
+            await self.list_vms()
+        # an unknown machine goes to the first host, which reports it the same way a single host would
+        return self.__hosts[self.__owners.get(vm_uuid, next(iter(self.__hosts)))]
+    def __merged_operation_id(self, responses: list[VirtualBoxApiResponse]) -> uuid.UUID | None:
+        if any(response.operation_id is None for response in responses):
+            return None
+        return uuid.uuid5(MERGED_OPERATIONS_NAMESPACE, ','.join(str(response.operation_id) for response in responses))
+    def __usage(self, name: str, machines: dict[uuid.UUID, FullMachineInfo]) -> HostUsage:
+        # powered off machines count as well, they are expected to be started on the host they live on
+        pending = self.__pending[name]
+        return HostUsage(
+            cpu_count = sum(info.cpu_count or 0 for info in machines.values()) + pending.cpu_count,
+            memory_mb = sum(info.memory_mb or 0 for info in machines.values()) + pending.memory_mb,
+            disk_gb = self.__disk_usage.get(name, 0) + pending.disk_gb,
+        )
+    def __last_known_machines(self, name: str) -> dict[uuid.UUID, FullMachineInfo]:
+        # the machines of a host which can not be reached, in the `unknown` state and otherwise as they were last listed
+        last_listing = self.__last_listings.get(name, dict())
+        return {
+            vm_uuid: (last_listing.get(vm_uuid) or FullMachineInfo(is_online = False, state = 'unknown', vrde_connection = VrdeConnectionInfo(host = '', port = 0))).model_copy(update = {'is_online': False, 'state': 'unknown'})
+            for (vm_uuid, owner) in self.__owners.items() if owner == name
+        }
+    async def __inspect_host(self, name: str, use_cache: bool) -> dict[uuid.UUID, FullMachineInfo]:
+        # one listing of the machines and one of the disks per host, the disks are not part of the machine listing
+        (listing, hdds) = await asyncio.gather(self.__hosts[name].list_vms_info(use_cache = use_cache), self.__hosts[name].list_hdds())
+        self.__owners.update((vm_uuid, name) for vm_uuid in listing.payload)
+        self.__last_listings[name] = listing.payload
+        self.__disk_usage[name] = self.__disk_usage_gb(hdds = hdds.payload)
+        return listing.payload
+    def __disk_usage_gb(self, hdds: list[HardDiskInfo]) -> int:
+        # a base disk may grow up to its capacity, the differencing disk of a linked clone takes only what was written to it
+        return math.ceil(sum(hdd.capacity_mb if hdd.parent_uuid is None else hdd.size_on_disk_mb for hdd in hdds) / 1024)
+    async def __place(self, requested: HostUsage) -> str:
+        names = list(self.__hosts)
+        # a cached listing may miss machines created moments ago, placing against it would overcommit the host
+        listings = await asyncio.gather(*(self.__inspect_host(name = name, use_cache = False) for name in names), return_exceptions = True)
+        scores: dict[str, float] = dict()
+        for (name, listing) in zip(names, listings):
+            if isinstance(listing, Exception):
+                logger.warning('host %s is skipped for placement, inspecting it failed', name, exc_info = listing)
+                continue
+            (capacity, usage) = (self.__capacities[name], self.__usage(name = name, machines = listing))
+            # the scarcest resource after the placement decides, so one exhausted dimension is not hidden by the others
+            score = min(
+                (capacity.cpu_count - usage.cpu_count - requested.cpu_count) / capacity.cpu_count,
+                (capacity.memory_mb - usage.memory_mb - requested.memory_mb) / capacity.memory_mb,
+                (capacity.disk_gb - usage.disk_gb - requested.disk_gb) / capacity.disk_gb,
+            )
+            if score >= 0:
+                scores[name] = score
+        if not scores:
+            raise NoCapacityError(f'No host has {requested.cpu_count} CPUs, {requested.memory_mb} MB of memory and {requested.disk_gb} GB of disk available')
+        return max(scores, key = scores.__getitem__)
+    def __reserve(self, name: str, requested: HostUsage, sign: int) -> None:
+        pending = self.__pending[name]
+        pending.cpu_count += sign * requested.cpu_count
+        pending.memory_mb += sign * requested.memory_mb
+        pending.disk_gb += sign * requested.disk_gb
+
+    async def stream_vm_command(self, vm_uuid: uuid.UUID, run_vm_command_info: RunVmCommand) -> typing.AsyncIterator[VBoxManageOutputEvent]:
+        host = await self.__host_of(vm_uuid = vm_uuid)
+        async with contextlib.aclosing(host.stream_vm_command(vm_uuid = vm_uuid, run_vm_command_info = run_vm_command_info)) as events:
+            async for event in events:
+                yield event
+    @validate_call(validate_return = True)
+    async def run_vm_command(self, vm_uuid: uuid.UUID, run_vm_command_info: RunVmCommand) -> VirtualBoxApiResponse[None]:
+        return await (await self.__host_of(vm_uuid = vm_uuid)).run_vm_command(vm_uuid = vm_uuid, run_vm_command_info = run_vm_command_info)
+
+    @validate_call(validate_return = True)
+    async def list_vms(self, use_cache: bool = True) -> VirtualBoxApiResponse[list[uuid.UUID]]:
+        responses = await self.__gather_listings(list_host = lambda host: host.list_vms(use_cache = use_cache))
+        for (name, response) in responses.items():
+            self.__owners.update((vm_uuid, name) for vm_uuid in response.payload)
+        return VirtualBoxApiResponse[list[uuid.UUID]](
+            payload = [vm_uuid for response in responses.values() for vm_uuid in response.payload] + [vm_uuid for (vm_uuid, name) in self.__owners.items() if name not in responses],
+            logs = [entry for response in responses.values() for entry in response.logs],
+            operation_id = self.__merged_operation_id(responses = list(responses.values())),
+        )
+    @validate_call(validate_return = True)
+    async def list_vms_info(self, states: set[str] | None = None, use_cache: bool = True) -> VirtualBoxApiResponse[dict[uuid.UUID, FullMachineInfo]]:
+        responses = await self.__gather_listings(list_host = lambda host: host.list_vms_info(use_cache = use_cache))
+        for (name, response) in responses.items():
+            self.__owners.update((vm_uuid, name) for vm_uuid in response.payload)
+            self.__last_listings[name] = response.payload
+        payload = {vm_uuid: vm_info for response in responses.values() for (vm_uuid, vm_info) in response.payload.items()}
+        for name in self.__hosts.keys() - responses.keys():
+            payload.update(self.__last_known_machines(name = name))
+        return VirtualBoxApiResponse[dict[uuid.UUID, FullMachineInfo]](
+            payload = {vm_uuid: vm_info for (vm_uuid, vm_info) in payload.items() if states is None or vm_info.state in states},
+            logs = [entry for response in responses.values() for entry in response.logs],
+            operation_id = self.__merged_operation_id(responses = list(responses.values())),
+        )
+    async def __gather_listings[ResponseType: VirtualBoxApiResponse](self, list_host: typing.Callable[[VirtualBoxApi], typing.Awaitable[ResponseType]]) -> dict[str, ResponseType]:
+        # an unreachable host does not take the listing of the others down, its machines are reported from what was last known of them
+        names = list(self.__hosts)
+        results = await asyncio.gather(*(list_host(self.__hosts[name]) for name in names), return_exceptions = True)
+        responses: dict[str, ResponseType] = dict()
+        for (name, result) in zip(names, results):
+            if isinstance(result, Exception):
+                logger.warning('host %s is skipped, listing its machines failed', name, exc_info = result)
+            else:
+                responses[name] = result
+        if not responses:
+            raise next(result for result in results if isinstance(result, Exception))
+        return responses
+    @validate_call(validate_return = True)
+    async def vm_info(self, vm_uuid: uuid.UUID, use_cache: bool = True) -> VirtualBoxApiResponse[FullMachineInfo]:
+        return await (await self.__host_of(vm_uuid = vm_uuid)).vm_info(vm_uuid = vm_uuid, use_cache = use_cache)
+
+    @validate_call(validate_return = True)
+    async def create_vm(self, machine_info: CreateMachineInfo) -> VirtualBoxApiResponse[uuid.UUID]:
+        # a linked clone starts out with an empty differencing disk, the drive size applies to machines created from an image only
+        requested = HostUsage(cpu_count = machine_info.hardware.cpu_count, memory_mb = machine_info.hardware.memory_mb, disk_gb = machine_info.drive.size_gb if machine_info.golden_template is None else 0)
+        # concurrent placements see each other's reservations instead of all picking the same emptiest host
+        async with self.__placement_lock:
+            name = await self.__place(requested = requested)
+            self.__reserve(name = name, requested = requested, sign = 1)
+        try:
+            response = await self.__hosts[name].create_vm(machine_info = machine_info)
+        finally:
+            self.__reserve(name = name, requested = requested, sign = -1)
+        self.__owners[response.payload] = name
+        return response
+    @validate_call(validate_return = True)
+    async def set_vrde_credentials(self, vm_uuid: uuid.UUID, vrde_credentials: CreateMachineInfo.VrdeCredentialsInfo, previous_username: str | None = None) -> VirtualBoxApiResponse[None]:
+        return await (await self.__host_of(vm_uuid = vm_uuid)).set_vrde_credentials(vm_uuid = vm_uuid, vrde_credentials = vrde_credentials, previous_username = previous_username)
+    @validate_call(validate_return = True)
+    async def take_clean_snapshot(self, vm_uuid: uuid.UUID) -> VirtualBoxApiResponse[None]:
+        return await (await self.__host_of(vm_uuid = vm_uuid)).take_clean_snapshot(vm_uuid = vm_uuid)
+    @validate_call(validate_return = True)
+    async def reset_vm(self, vm_uuid: uuid.UUID, start: bool = False) -> VirtualBoxApiResponse[VrdeConnectionInfo | None]:
+        return await (await self.__host_of(vm_uuid = vm_uuid)).reset_vm(vm_uuid = vm_uuid, start = start)
+    @validate_call(validate_return = True)
+    async def delete_vm(self, vm_uuid: uuid.UUID) -> VirtualBoxApiResponse[None]:
+        response = await (await self.__host_of(vm_uuid = vm_uuid)).delete_vm(vm_uuid = vm_uuid)
+        self.__owners.pop(vm_uuid, None)
+        for listing in self.__last_listings.values():
+            listing.pop(vm_uuid, None)
+        return response
+    @validate_call(validate_return = True)
+    async def start_vm(self, vm_uuid: uuid.UUID) -> VirtualBoxApiResponse[VrdeConnectionInfo]:
+        return await (await self.__host_of(vm_uuid = vm_uuid)).start_vm(vm_uuid = vm_uuid)
+    @validate_call(validate_return = True)
+    async def stop_vm(self, vm_uuid: uuid.UUID) -> VirtualBoxApiResponse[None]:
+        return await (await self.__host_of(vm_uuid = vm_uuid)).stop_vm(vm_uuid = vm_uuid)
@@ -0,0 +1,27 @@
+import pydantic
+
+HostName = pydantic.constr(pattern = r'^[a-zA-Z0-9][a-zA-Z0-9_.-]*$')
+
+class HostCapacity(pydantic.BaseModel):
+    # schedulable totals, cpu_count may be set above the physical count to overcommit
+    cpu_count: pydantic.PositiveInt
+    memory_mb: pydantic.PositiveInt
+    disk_gb: pydantic.PositiveInt
+
+class HostUsage(pydantic.BaseModel):
+    cpu_count: pydantic.NonNegativeInt = 0
+    memory_mb: pydantic.NonNegativeInt = 0
+    disk_gb: pydantic.NonNegativeInt = 0
+
+class HostInfo(pydantic.BaseModel):
+    name: HostName # type: ignore
+    advertised_host: str
+    capacity: HostCapacity
+    usage: HostUsage
+    machines: pydantic.NonNegativeInt
+    # usage and machines of an unreachable host are the ones last seen
+    reachable: bool = True
+
+class NoCapacityError(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
@@ -1,26 +1,85 @@
-from domain.images.models import ImageFile, ImageName
+from domain.images.models import ImageFile, ImageName, ImageInfo
+from domain.indexes import DirectoryIndex
+from domain.validation import validate_call
+import concurrent.futures
+import threading
+import hashlib
 import pydantic
+import logging
+import typing
 import abc
 import os
 
+logger = logging.getLogger(__name__)
+
 
 class AbstractImageRepository(abc.ABC):
     @abc.abstractmethod
-    @pydantic.validate_call(validate_return = True)
+    @validate_call(validate_return = True)
     def list_images(self) -> list[ImageName]:
         raise NotImplementedError(f'{type(self)}.list_images')
+    @abc.abstractmethod
+    @validate_call(validate_return = True)
+    def list_image_infos(self, with_hash: bool = False) -> list[ImageInfo]:
+        raise NotImplementedError(f'{type(self)}.list_image_infos')
+    @validate_call(validate_return = True)
+    def close(self) -> None:
+        pass
 
 
 class LocalImageRepository(AbstractImageRepository):
-    @pydantic.validate_call(validate_return = True)
-    def __init__(self, images_dir: str) -> None:
+    IMAGE_FILE_ADAPTER = pydantic.TypeAdapter(ImageFile)
+    HASH_CHUNK_SIZE: typing.ClassVar[int] = 1024 * 1024
+
+    @validate_call(validate_return = True)
+    def __init__(self, images_dir: str, refresh_interval_s: pydantic.NonNegativeFloat = 1) -> None:
         self.__images_dir: str = images_dir
-    @pydantic.validate_call(validate_return = True)
+        self.__index: DirectoryIndex[ImageInfo] = DirectoryIndex(directory = images_dir, build_entry = self.__build_entry, refresh_interval_s = refresh_interval_s)
+        # one image is hashed at a time, isos are usually read from a network share
+        self.__hash_executor: concurrent.futures.ThreadPoolExecutor = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'image-hash')
+        # filename -> the entry being hashed, a changed file gets a new entry and is hashed again
+        self.__hashing: dict[str, ImageInfo] = dict()
+        self.__hashing_lock = threading.Lock()
+        self.__closed = threading.Event()
+    def __build_entry(self, filename: str, path: str, stat: os.stat_result) -> ImageInfo | None:
+        try:
+            self.IMAGE_FILE_ADAPTER.validate_python(filename)
+        except pydantic.ValidationError:
+            return None
+        # hashing an iso is expensive, it is computed on first demand and kept until the file changes
+        return ImageInfo(name = filename[0:-4], size_bytes = stat.st_size)
+    @validate_call(validate_return = True)
     def list_images(self) -> list[ImageName]:
-        configs: list[ImageName] = []
-        for filename in os.listdir(self.__images_dir):
-            try:
-                configs.append(pydantic.RootModel[ImageName](root = pydantic.RootModel[ImageFile](root = filename).root[0:-4]).root)
-            except Exception:
-                pass
-        return configs
+        return [image_info.name for image_info in self.__index.entries().values()]
+    @validate_call(validate_return = True)
+    def list_image_infos(self, with_hash: bool = False) -> list[ImageInfo]:
+        image_infos = list(self.__index.entries().items())
+        if with_hash:
+            # hashing takes minutes for large isos, `sha256` stays `None` until the background hash is done
+            with self.__hashing_lock:
+                for (filename, image_info) in image_infos:
+                    if image_info.sha256 is None and self.__hashing.get(filename) is not image_info:
+                        self.__hashing[filename] = image_info
+                        self.__hash_executor.submit(self.__hash_image, filename, image_info)
+        return [image_info.model_copy() for (_, image_info) in image_infos]
+    @validate_call(validate_return = True)
+    def close(self) -> None:
+        self.__closed.set()
+        self.__hash_executor.shutdown(cancel_futures = True)
+        self.__index.close()
+
+    def __hash_image(self, filename: str, image_info: ImageInfo) -> None:
+        digest = hashlib.sha256()
+        try:
+            with open(file = f'{self.__images_dir}/{filename}', mode = 'rb') as image_file:
+                while chunk := image_file.read(self.HASH_CHUNK_SIZE):
+                    if self.__closed.is_set():
+                        return
+                    digest.update(chunk)
+            image_info.sha256 = digest.hexdigest()
+        except OSError:
+            logger.warning('hashing the image %s failed', filename, exc_info = True)
+        finally:
+            with self.__hashing_lock:
+                if self.__hashing.get(filename) is image_info:
+                    del self.__hashing[filename]
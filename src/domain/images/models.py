@@ -2,3 +2,8 @@ import pydantic
 
 ImageFile = pydantic.constr(pattern = r'^[a-zA-Z0-9](?:[a-zA-Z0-9_-]|\.?[a-zA-Z0-9_-])*\.iso$')
 ImageName = pydantic.constr(pattern = r'^[a-zA-Z0-9](?:[a-zA-Z0-9_-]|\.?[a-zA-Z0-9_-])*$')
+
+class ImageInfo(pydantic.BaseModel):
+    name: ImageName # type: ignore
+    size_bytes: pydantic.NonNegativeInt
+    sha256: str | None = None
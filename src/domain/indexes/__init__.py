@@ -0,0 +1,72 @@
+from domain.validation import validate_call
+import concurrent.futures
+import threading
+import pydantic
+import logging
+import typing
+import time
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class DirectoryIndex[EntryType]:
+    @validate_call(config = pydantic.ConfigDict(arbitrary_types_allowed = True), validate_return = True)
+    def __init__(self, directory: str, build_entry: typing.Callable[[str, str, os.stat_result], EntryType | None], refresh_interval_s: pydantic.NonNegativeFloat = 1) -> None:
+        self.__directory: str = directory
+        self.__build_entry: typing.Callable[[str, str, os.stat_result], EntryType | None] = build_entry
+        self.__refresh_interval_s: float = refresh_interval_s
+        # filename -> ((size, mtime), entry), an entry is rebuilt only when its file signature changes
+        self.__entries: dict[str, tuple[tuple[int, int], EntryType]] = dict()
+        # what readers get, replaced as a whole after each refresh so they never wait for a scan
+        self.__snapshot: dict[str, EntryType] = dict()
+        self.__refreshed_at: float = -math.inf
+        # scanning a directory on a network share takes a while, it happens on this thread instead of the event loop
+        self.__refresh_executor: concurrent.futures.ThreadPoolExecutor = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'directory-index')
+        self.__pending_refresh: concurrent.futures.Future[None] | None = None
+        self.__lock = threading.Lock()
+        # the first scan happens at startup, readers never see an index that was not built yet
+        self.__refresh()
+
+    def entries(self) -> dict[str, EntryType]:
+        # the last snapshot is returned right away, a stale one schedules a refresh which the following calls see
+        with self.__lock:
+            if time.monotonic() - self.__refreshed_at >= self.__refresh_interval_s and self.__pending_refresh is None:
+                self.__schedule_refresh()
+            return dict(self.__snapshot)
+    def invalidate(self) -> None:
+        with self.__lock:
+            self.__refreshed_at = -math.inf
+    def close(self) -> None:
+        self.__refresh_executor.shutdown(cancel_futures = True)
+
+    def __schedule_refresh(self) -> None:
+        try:
+            self.__pending_refresh = self.__refresh_executor.submit(self.__refresh)
+        except RuntimeError:
+            # the executor is shut down, the index keeps serving its last snapshot
+            self.__pending_refresh = None
+    def __refresh(self) -> None:
+        try:
+            self.__scan()
+        except OSError:
+            logger.warning('indexing the directory %s failed', self.__directory, exc_info = True)
+        finally:
+            with self.__lock:
+                self.__refreshed_at = time.monotonic()
+                self.__pending_refresh = None
+    def __scan(self) -> None:
+        entries: dict[str, tuple[tuple[int, int], EntryType]] = dict()
+        with os.scandir(self.__directory) as directory_entries:
+            for directory_entry in directory_entries:
+                if not directory_entry.is_file():
+                    continue
+                stat = directory_entry.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if (known_entry := self.__entries.get(directory_entry.name)) is not None and known_entry[0] == signature:
+                    entries[directory_entry.name] = known_entry
+                elif (entry := self.__build_entry(directory_entry.name, directory_entry.path, stat)) is not None:
+                    entries[directory_entry.name] = (signature, entry)
+        self.__entries = entries
+        self.__snapshot = {filename: entry for (filename, (_, entry)) in entries.items()}
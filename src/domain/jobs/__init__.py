@@ -0,0 +1,174 @@
+from domain.machines.models import VirtualBoxApiResponse, VirtualBoxApiError, CreateMachineInfo, LogEntry
+from domain.jobs.models import JobKind, JobStatus, JobInfo
+from domain.machines import VirtualBoxApi
+from domain.hosts import HostRegistry
+from domain.validation import validate_call
+from domain.metrics import REGISTRY
+import contextvars
+import contextlib
+import itertools
+import pydantic
+import asyncio
+import logging
+import sqlite3
+import typing
+import json
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# set while a worker runs a job, stage spans of the operation are attributed to it
+CURRENT_JOB: contextvars.ContextVar[uuid.UUID | None] = contextvars.ContextVar('current_job', default = None)
+
+
+class JobQueue:
+    SCHEMA: typing.ClassVar[str] = '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, priority INTEGER NOT NULL,
+            arguments TEXT, stages TEXT NOT NULL, result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL
+        )
+    '''
+
+    @validate_call(config = pydantic.ConfigDict(arbitrary_types_allowed = True), validate_return = True)
+    def __init__(self, vbox_api: VirtualBoxApi | HostRegistry, database_path: str = ':memory:', workers: pydantic.PositiveInt = 4, retention_s: pydantic.PositiveFloat = 24 * 60 * 60) -> None:
+        self.__vbox_api: VirtualBoxApi | HostRegistry = vbox_api
+        self.__workers_count: int = workers
+        self.__retention_s: float = retention_s
+        # only touched from the event loop, statements are short enough to not be worth a thread hop
+        self.__database: sqlite3.Connection = sqlite3.connect(database_path, isolation_level = None, check_same_thread = False)
+        self.__database.execute('PRAGMA journal_mode = WAL')
+        self.__database.execute('PRAGMA synchronous = NORMAL')
+        self.__database.execute(self.SCHEMA)
+        self.__queue: asyncio.PriorityQueue[tuple[int, int, uuid.UUID]] = asyncio.PriorityQueue()
+        self.__sequence: itertools.count[int] = itertools.count()
+        self.__finished_events: dict[uuid.UUID, asyncio.Event] = dict()
+        self.__workers: list[asyncio.Task[None]] = []
+
+    def start(self) -> None:
+        now = time.time()
+        # nothing tells how far a job got before the previous process died, so it is not retried
+        self.__database.execute(
+            'UPDATE jobs SET status = ?, arguments = NULL, error = ?, updated_at = ? WHERE status = ?',
+            ('interrupted', json.dumps({'message': 'The server restarted while the job was running'}), now, 'running'),
+        )
+        self.__database.execute('DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?', ('succeeded', 'failed', 'interrupted', now - self.__retention_s))
+        for (job_id, priority) in self.__database.execute('SELECT id, priority FROM jobs WHERE status = ? ORDER BY created_at', ('queued',)).fetchall():
+            self.__enqueue(job_id = uuid.UUID(job_id), priority = priority)
+        REGISTRY.add_span_hook(self.__track_stage)
+        self.__workers = [asyncio.create_task(self.__work()) for _ in range(self.__workers_count)]
+    async def stop(self) -> None:
+        if self.__workers:
+            for worker in self.__workers:
+                worker.cancel()
+            await asyncio.gather(*self.__workers, return_exceptions = True)
+            self.__workers = []
+            REGISTRY.remove_span_hook(self.__track_stage)
+        self.__database.close()
+
+    @validate_call(validate_return = True)
+    def submit_create_vm(self, machine_info: CreateMachineInfo, priority: int = 0) -> JobInfo:
+        # the row outlives the request and may be queued across a restart, only the password hash the machine is set up with is kept
+        if isinstance(machine_info.vrde_credentials, CreateMachineInfo.VrdeCredentialsInfo):
+            machine_info = machine_info.model_copy(update = {'vrde_credentials': CreateMachineInfo.HashedVrdeCredentialsInfo(username = machine_info.vrde_credentials.username, password_sha256 = machine_info.vrde_credentials.password_sha256)})
+        return self.__submit(kind = 'create_vm', arguments = {'machine_info': machine_info.model_dump(mode = 'json')}, priority = priority)
+    @validate_call(validate_return = True)
+    def submit_delete_vm(self, vm_uuid: uuid.UUID, priority: int = 0) -> JobInfo:
+        return self.__submit(kind = 'delete_vm', arguments = {'vm_uuid': str(vm_uuid)}, priority = priority)
+    @validate_call(validate_return = True)
+    def submit_start_vm(self, vm_uuid: uuid.UUID, priority: int = 0) -> JobInfo:
+        return self.__submit(kind = 'start_vm', arguments = {'vm_uuid': str(vm_uuid)}, priority = priority)
+
+    @validate_call(validate_return = True)
+    def get(self, job_id: uuid.UUID) -> JobInfo | None:
+        row = self.__database.execute('SELECT id, kind, status, priority, stages, result, error, created_at, updated_at FROM jobs WHERE id = ?', (str(job_id),)).fetchone()
+        if row is None:
+            return None
+        (job_id, kind, status, priority, stages, result, error, created_at, updated_at) = row
+        return JobInfo(
+            id = job_id, kind = kind, status = status, priority = priority, stages = json.loads(stages),
+            result = json.loads(result) if result is not None else None, error = json.loads(error) if error is not None else None,
+            created_at = created_at, updated_at = updated_at,
+        )
+    @validate_call(validate_return = True)
+    async def wait(self, job_id: uuid.UUID, timeout_s: pydantic.NonNegativeFloat) -> JobInfo | None:
+        # long polling, returns as soon as the job finishes or with its current state after the timeout
+        if (job := self.get(job_id = job_id)) is None or job.finished or timeout_s == 0:
+            return job
+        finished_event = self.__finished_events.setdefault(job_id, asyncio.Event())
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(finished_event.wait(), timeout = timeout_s)
+        return self.get(job_id = job_id)
+
+    def __submit(self, kind: JobKind, arguments: dict[str, typing.Any], priority: int) -> JobInfo:
+        (job_id, now) = (uuid.uuid4(), time.time())
+        self.__database.execute(
+            'INSERT INTO jobs (id, kind, status, priority, arguments, stages, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (str(job_id), kind, 'queued', priority, json.dumps(arguments), '[]', now, now),
+        )
+        self.__enqueue(job_id = job_id, priority = priority)
+        return self.get(job_id = job_id)
+    def __enqueue(self, job_id: uuid.UUID, priority: int) -> None:
+        self.__queue.put_nowait((-priority, next(self.__sequence), job_id))
+    def __update(self, job_id: uuid.UUID, status: JobStatus, result: dict[str, typing.Any] | None = None, error: dict[str, typing.Any] | None = None) -> None:
+        if status == 'running':
+            self.__database.execute('UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?', (status, time.time(), str(job_id)))
+            return
+        # the arguments may hold credentials and are not needed once the job is over
+        self.__database.execute(
+            'UPDATE jobs SET status = ?, arguments = NULL, result = ?, error = ?, updated_at = ? WHERE id = ?',
+            (status, json.dumps(result) if result is not None else None, json.dumps(error) if error is not None else None, time.time(), str(job_id)),
+        )
+        if (finished_event := self.__finished_events.pop(job_id, None)) is not None:
+            finished_event.set()
+    @contextlib.contextmanager
+    def __track_stage(self, name: str, attributes: dict[str, str]) -> typing.Iterator[None]:
+        if (job_id := CURRENT_JOB.get()) is not None and not name.startswith('vbox_api.'):
+            self.__database.execute('UPDATE jobs SET stages = json_insert(stages, \'$[#]\', ?), updated_at = ? WHERE id = ?', (name, time.time(), str(job_id)))
+        yield
+
+    async def __work(self) -> None:
+        while True:
+            (_, _, job_id) = await self.__queue.get()
+            token = CURRENT_JOB.set(job_id)
+            try:
+                await self.__run(job_id = job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('job %s crashed', job_id)
+            finally:
+                CURRENT_JOB.reset(token)
+                self.__queue.task_done()
+    async def __run(self, job_id: uuid.UUID) -> None:
+        row = self.__database.execute('SELECT kind, arguments FROM jobs WHERE id = ? AND status = ?', (str(job_id), 'queued')).fetchone()
+        if row is None:
+            return
+        (kind, arguments) = (row[0], json.loads(row[1]))
+        self.__update(job_id = job_id, status = 'running')
+        try:
+            response = await self.__execute(kind = kind, arguments = arguments)
+        except VirtualBoxApiError as error:
+            # the call arguments may hold credentials, such as the password hash passed to setextradata
+            self.__update(job_id = job_id, status = 'failed', error = {
+                'stage': error.stage, 'call': error.error_info.model_dump(mode = 'json', exclude = {'args'}),
+                'rollback': [entry.model_dump(mode = 'json', exclude = {'call': {'args'}}) for entry in error.rollback_logs],
+            })
+        except asyncio.CancelledError:
+            self.__update(job_id = job_id, status = 'interrupted', error = {'message': 'The server shut down while the job was running'})
+            raise
+        except Exception as error:
+            logger.exception('job %s of kind %s failed', job_id, kind)
+            self.__update(job_id = job_id, status = 'failed', error = {'message': str(error)})
+        else:
+            # only the stages are persisted, the calls stay in memory with the operation logs
+            self.__update(job_id = job_id, status = 'succeeded', result = response.model_copy(update = {'logs': [LogEntry(stage = entry.stage) for entry in response.logs]}).model_dump(mode = 'json'))
+    async def __execute(self, kind: JobKind, arguments: dict[str, typing.Any]) -> VirtualBoxApiResponse:
+        match kind:
+            case 'create_vm':
+                return await self.__vbox_api.create_vm(machine_info = CreateMachineInfo.model_validate(arguments['machine_info']))
+            case 'delete_vm':
+                return await self.__vbox_api.delete_vm(vm_uuid = uuid.UUID(arguments['vm_uuid']))
+            case 'start_vm':
+                return await self.__vbox_api.start_vm(vm_uuid = uuid.UUID(arguments['vm_uuid']))
+        raise ValueError(f'Unknown job kind {kind}')
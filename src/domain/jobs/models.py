@@ -0,0 +1,24 @@
+import pydantic
+import typing
+import uuid
+
+JobKind = typing.Literal['create_vm', 'delete_vm', 'start_vm']
+JobStatus = typing.Literal['queued', 'running', 'succeeded', 'failed', 'interrupted']
+
+class JobInfo(pydantic.BaseModel):
+    id: uuid.UUID
+    kind: JobKind
+    status: JobStatus
+    # higher runs first, equal priorities run in submission order
+    priority: int = 0
+    # stages started so far, the last one is in progress while the job is running
+    stages: list[str] = []
+    # the `VirtualBoxApiResponse` of a succeeded job with its logs cut down to the stages, the error body of a failed one without the call arguments
+    result: dict[str, typing.Any] | None = None
+    error: dict[str, typing.Any] | None = None
+    created_at: float
+    updated_at: float
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('succeeded', 'failed', 'interrupted')
@@ -1,41 +1,139 @@
-from . models import RunVmCommand, VBoxManageCallResult, LogEntry, VirtualBoxApiResponse, VirtualBoxApiError, VrdeConnectionInfo, CreateMachineInfo, FullMachineInfo
-import subprocess
+from . models import RunVmCommand, VBoxManageCallResult, VBoxManageOutputEvent, LogEntry, VirtualBoxApiResponse, VirtualBoxApiError, NoCleanSnapshotError, VrdeConnectionInfo, CreateMachineInfo, FullMachineInfo, HardDiskInfo
+from . backends import AbstractVBoxManageBackend, SubprocessVBoxManageBackend
+from . cache import MachineStateCache
+from . import metrics
+from domain.validation import validate_call
+import contextlib
+import itertools
 import pydantic
-import hashlib
+import asyncio
+import logging
+import weakref
 import socket
+import typing
+import re
 import uuid
 
+logger = logging.getLogger(__name__)
+
 
 class VirtualBoxApi:
-    @pydantic.validate_call(validate_return = True)
-    def __init__(self, machines_dir: str, storages_dir: str, images_dir: str, advertised_host: str, vboxmanage_bin: str = 'VBoxManage') -> None:
+    # `list vms --long` state names mapped to the `showvminfo --machinereadable` ones
+    LONG_LIST_STATES: typing.ClassVar[dict[str, str]] = {
+        'powered off': 'poweroff', 'saved': 'saved', 'teleported': 'teleported', 'aborted': 'aborted', 'aborted-saved': 'abortedsaved',
+        'running': 'running', 'paused': 'paused', 'guru meditation': 'gurumeditation', 'teleporting': 'teleporting', 'live snapshotting': 'livesnapshotting',
+        'starting': 'starting', 'stopping': 'stopping', 'saving': 'saving', 'restoring': 'restoring',
+    }
+    # the snapshot a reset goes back to
+    CLEAN_SNAPSHOT: typing.ClassVar[str] = 'clean'
+
+    @validate_call(config = pydantic.ConfigDict(arbitrary_types_allowed = True), validate_return = True)
+    def __init__(self, machines_dir: str, storages_dir: str, images_dir: str, advertised_host: str, vboxmanage_bin: str = 'VBoxManage', backend: AbstractVBoxManageBackend | None = None, max_concurrent_calls: pydantic.PositiveInt = 16, cache_ttl_ms: pydantic.NonNegativeInt = 0, cache_max_size: pydantic.PositiveInt = 4096, command_output_limit_bytes: pydantic.PositiveInt = 1024 * 1024, command_timeout_grace_ms: pydantic.NonNegativeInt = 10000) -> None:
+        self.__backend: AbstractVBoxManageBackend = backend if backend is not None else SubprocessVBoxManageBackend(vboxmanage_bin = vboxmanage_bin)
         self.__advertised_host: str = advertised_host
-        self.__vboxmanage_bin: str = vboxmanage_bin
         self.__machines_dir: str = machines_dir
         self.__storages_dir: str = storages_dir
         self.__images_dir: str = images_dir
+        self.__calls_semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrent_calls)
+        self.__vm_locks: weakref.WeakValueDictionary[uuid.UUID, asyncio.Lock] = weakref.WeakValueDictionary()
+        self.__cache: MachineStateCache = MachineStateCache(ttl_ms = cache_ttl_ms, max_size = cache_max_size)
+        self.__command_output_limit_bytes: int = command_output_limit_bytes
+        self.__command_timeout_grace_s: float = command_timeout_grace_ms / 1000
+        self.__vrde_ports: dict[uuid.UUID, int] = dict()
+
+    @property
+    def advertised_host(self) -> str:
+        return self.__advertised_host
 
-    @pydantic.validate_call(validate_return = True)
+    @validate_call(validate_return = True)
     def __get_free_port(self, host: str) -> int:
         sock = socket.socket()
-        sock.bind((host, 0))
+        try:
+            sock.bind((host, 0))
+        except OSError:
+            # the advertised address belongs to another machine, `__pick_vrde_port` keeps clear of the ports its machines use
+            sock.bind(('', 0))
         (host, port) = sock.getsockname()
         sock.close()
         return port
-    @pydantic.validate_call(validate_return = True)
-    def __execute_call(self, args: list[str]) -> VBoxManageCallResult:
-        raw_result = subprocess.run(args = [self.__vboxmanage_bin] + args, capture_output = True)
-        return VBoxManageCallResult(
-            status = raw_result.returncode,
-            stdout = raw_result.stdout,
-            stderr = raw_result.stderr,
-            args = raw_result.args,
-        )
+    @validate_call(validate_return = True)
+    async def __pick_vrde_port(self, vm_uuid: uuid.UUID) -> int:
+        # the probe only sees listeners of the api host, the ports configured on the machines of the vbox host are excluded as well,
+        # together with the ones handed out here which a cached listing may not show yet
+        used_ports = {vm_info.vrde_connection.port for (other_uuid, vm_info) in (await self.list_vms_info()).payload.items() if other_uuid != vm_uuid}
+        used_ports.update(port for (other_uuid, port) in self.__vrde_ports.items() if other_uuid != vm_uuid)
+        while (port := self.__get_free_port(host = self.__advertised_host)) in used_ports:
+            pass
+        self.__vrde_ports[vm_uuid] = port
+        return port
+    @validate_call(validate_return = True)
+    async def __execute_call(self, stage: str, args: list[str]) -> VBoxManageCallResult:
+        subcommand = metrics.subcommand_of(args = args)
+        with metrics.REGISTRY.span(stage, subcommand = subcommand), metrics.STAGE_DURATION.time(stage = stage):
+            with metrics.CALLS_WAITING.track_in_progress():
+                await self.__calls_semaphore.acquire()
+            try:
+                with metrics.CALLS_IN_FLIGHT.track_in_progress(), metrics.CALL_DURATION.time(subcommand = subcommand):
+                    result = await self.__backend.execute_async(args = args)
+            finally:
+                self.__calls_semaphore.release()
+            metrics.CALLS_TOTAL.inc(subcommand = subcommand, status = str(result.status))
+            return result
+    @contextlib.asynccontextmanager
+    async def __lock_vm(self, vm_uuid: uuid.UUID) -> typing.AsyncIterator[None]:
+        # state changing operations on one machine are serialized, different machines proceed in parallel
+        async with self.__vm_locks.setdefault(vm_uuid, asyncio.Lock()):
+            yield
 
-    @pydantic.validate_call(validate_return = True)
-    def run_vm_command(self, vm_uuid: uuid.UUID, run_vm_command_info: RunVmCommand) -> VirtualBoxApiResponse[None]:
+    def __run_vm_command_args(self, vm_uuid: uuid.UUID, run_vm_command_info: RunVmCommand) -> list[str]:
         # result = self.__execute_call(args = ['--nologo', 'guestcontrol', str(vm_uuid), 'run', '--exe', run_vm_command_info.executable, '--username', run_vm_command_info.username, '--password', run_vm_command_info.password, '--verbose', '--wait-stdout', '--wait-stderr', '--'] + run_vm_command_info.arguments)
-        result = self.__execute_call(args = ['--nologo', 'guestcontrol', str(vm_uuid), 'run', '--exe', run_vm_command_info.executable, '--username', run_vm_command_info.username, '--password', run_vm_command_info.password, '--wait-stdout', '--wait-stderr', '--'] + run_vm_command_info.arguments)
+        return ['--nologo', 'guestcontrol', str(vm_uuid), 'run', '--exe', run_vm_command_info.executable, '--username', run_vm_command_info.username, '--password', run_vm_command_info.password, '--timeout', str(run_vm_command_info.timeout_ms), '--wait-stdout', '--wait-stderr', '--'] + run_vm_command_info.arguments
+    async def stream_vm_command(self, vm_uuid: uuid.UUID, run_vm_command_info: RunVmCommand) -> typing.AsyncIterator[VBoxManageOutputEvent]:
+        # the guest kills the process after `--timeout`, the host side deadline also covers a hung guest session
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + run_vm_command_info.timeout_ms / 1000 + self.__command_timeout_grace_s
+        with metrics.CALLS_WAITING.track_in_progress():
+            await self.__calls_semaphore.acquire()
+        try:
+            with metrics.CALLS_IN_FLIGHT.track_in_progress(), metrics.CALL_DURATION.time(subcommand = 'guestcontrol'):
+                async with contextlib.aclosing(self.__backend.stream_async(args = self.__run_vm_command_args(vm_uuid = vm_uuid, run_vm_command_info = run_vm_command_info))) as events:
+                    while True:
+                        try:
+                            event = await asyncio.wait_for(anext(events), timeout = deadline - loop.time())
+                        except StopAsyncIteration:
+                            return
+                        except TimeoutError:
+                            event = VBoxManageOutputEvent(kind = 'exit', timed_out = True)
+                        if event.kind == 'exit':
+                            metrics.CALLS_TOTAL.inc(subcommand = 'guestcontrol', status = 'timeout' if event.timed_out else str(event.status))
+                        yield event
+                        if event.timed_out:
+                            return
+        finally:
+            self.__calls_semaphore.release()
+    @metrics.instrument_operation
+    @validate_call(validate_return = True)
+    async def run_vm_command(self, vm_uuid: uuid.UUID, run_vm_command_info: RunVmCommand) -> VirtualBoxApiResponse[None]:
+        # only the head of each stream is kept, use `stream_vm_command` for the full output
+        output: dict[str, list[str]] = {'stdout': [], 'stderr': []}
+        output_sizes: dict[str, int] = {'stdout': 0, 'stderr': 0}
+        (status, timed_out, truncated) = (None, False, False)
+        async for event in self.stream_vm_command(vm_uuid = vm_uuid, run_vm_command_info = run_vm_command_info):
+            if event.kind == 'exit':
+                (status, timed_out) = (event.status, event.timed_out)
+                continue
+            data = event.data.encode()
+            if (room := self.__command_output_limit_bytes - output_sizes[event.kind]) < len(data):
+                (data, truncated) = (data[:room], True)
+            output[event.kind].append(data.decode(errors = 'ignore'))
+            output_sizes[event.kind] += len(data)
+        result = VBoxManageCallResult(
+            args = ['VBoxManage'] + self.__run_vm_command_args(vm_uuid = vm_uuid, run_vm_command_info = run_vm_command_info),
+            status = status if status is not None else -1,
+            stdout = ''.join(output['stdout']),
+            stderr = ''.join(output['stderr']) + ('VBoxManage: error: timed out on the host side\n' if timed_out else ''),
+            truncated = truncated,
+        )
         if result.status != 0:
             raise VirtualBoxApiError(error_info = result, stage = 'run_vm_command.root')
 
@@ -43,19 +141,96 @@ class VirtualBoxApi:
             payload = None, logs = [LogEntry(stage = 'run_vm_command.root', call = result)]
         )
 
-    @pydantic.validate_call(validate_return = True)
-    def list_vms(self) -> VirtualBoxApiResponse[list[uuid.UUID]]:
-        result = self.__execute_call(args = ['list', 'vms'])
+    @metrics.instrument_operation
+    @validate_call(validate_return = True)
+    async def list_vms(self, use_cache: bool = True) -> VirtualBoxApiResponse[list[uuid.UUID]]:
+        if use_cache and (cached_response := self.__cache.get(key = 'list_vms')) is not None:
+            return cached_response
+        result = await self.__execute_call(stage = 'list_vms.get_raw_list_vms', args = ['list', 'vms'])
         if result.status != 0:
             raise VirtualBoxApiError(error_info = result, stage = 'list_vms.get_raw_list_vms')
 
-        return VirtualBoxApiResponse[list[uuid.UUID]](
+        response = VirtualBoxApiResponse[list[uuid.UUID]](
             payload = [uuid.UUID(line[-37:-1]) for line in result.stdout.splitlines() if len(line) > 0],
-            logs = [LogEntry(stage = 'list_vms.root', call = result)]
+            logs = [LogEntry(stage = 'list_vms.root', call = result)],
+            # cache hits keep the id, so the operation log stores the calls once however often they are served
+            operation_id = uuid.uuid4()
+        )
+        self.__cache.put(key = 'list_vms', value = response)
+        return response
+    @metrics.instrument_operation
+    @validate_call(validate_return = True)
+    async def list_vms_info(self, states: set[str] | None = None, use_cache: bool = True) -> VirtualBoxApiResponse[dict[uuid.UUID, FullMachineInfo]]:
+        if not use_cache or (response := self.__cache.get(key = 'list_vms_info')) is None:
+            result = await self.__execute_call(stage = 'list_vms_info.get_raw_list_vms', args = ['list', 'vms', '--long'])
+            if result.status != 0:
+                raise VirtualBoxApiError(error_info = result, stage = 'list_vms_info.get_raw_list_vms')
+            response = VirtualBoxApiResponse[dict[uuid.UUID, FullMachineInfo]](
+                payload = dict(self.__parse_long_vms_list(raw_list = result.stdout)),
+                logs = [LogEntry(stage = 'list_vms_info.get_raw_list_vms', call = result)],
+                operation_id = uuid.uuid4()
+            )
+            # the cache keeps the unfiltered listing, every state filter is served from it
+            self.__cache.put(key = 'list_vms_info', value = response)
+
+        if states is not None:
+            response.payload = {vm_uuid: vm_info for (vm_uuid, vm_info) in response.payload.items() if vm_info.state in states}
+        return response
+    def __parse_long_vms_list(self, raw_list: str) -> typing.Iterator[tuple[uuid.UUID, FullMachineInfo]]:
+        # single pass over the human readable `list vms --long` output, one block per machine starting with `Name:`
+        raw_vm_info_dict: dict[str, str] = dict()
+        for line in itertools.chain(raw_list.splitlines(), ['Name:']):
+            if len(chunks := line.split(':', maxsplit = 1)) != 2:
+                continue
+            (key, value) = (chunks[0], chunks[1].strip())
+            if key == 'Name' and 'Host path:' not in value:
+                if 'UUID' in raw_vm_info_dict and 'State' in raw_vm_info_dict:
+                    yield (uuid.UUID(raw_vm_info_dict['UUID']), self.__build_long_vm_info(raw_vm_info_dict = raw_vm_info_dict))
+                raw_vm_info_dict = dict()
+            raw_vm_info_dict.setdefault(key, value)
+    def __build_long_vm_info(self, raw_vm_info_dict: dict[str, str]) -> FullMachineInfo:
+        state = self.LONG_LIST_STATES.get(raw_vm_info_dict['State'].split(' (', maxsplit = 1)[0], raw_vm_info_dict['State'])
+        vrde_connection = VrdeConnectionInfo(host = '', port = 0)
+        if (vrde_match := re.match(r'enabled \(Address (?P<host>[^,]*), Ports (?P<port>\d+)', raw_vm_info_dict.get('VRDE', ''))) is not None:
+            vrde_connection = VrdeConnectionInfo(host = vrde_match['host'], port = int(vrde_match['port']))
+        return FullMachineInfo(
+            is_online = (state == 'running'), state = state, vrde_connection = vrde_connection,
+            cpu_count = int(raw_vm_info_dict['Number of CPUs']) if raw_vm_info_dict.get('Number of CPUs', '').isdigit() else None,
+            memory_mb = int(raw_vm_info_dict['Memory size'].removesuffix('MB')) if raw_vm_info_dict.get('Memory size', '').removesuffix('MB').isdigit() else None,
+        )
+    @metrics.instrument_operation
+    @validate_call(validate_return = True)
+    async def list_hdds(self) -> VirtualBoxApiResponse[list[HardDiskInfo]]:
+        result = await self.__execute_call(stage = 'list_hdds.get_raw_list_hdds', args = ['list', 'hdds'])
+        if result.status != 0:
+            raise VirtualBoxApiError(error_info = result, stage = 'list_hdds.get_raw_list_hdds')
+        return VirtualBoxApiResponse[list[HardDiskInfo]](
+            payload = list(self.__parse_hdds_list(raw_list = result.stdout)),
+            logs = [LogEntry(stage = 'list_hdds.get_raw_list_hdds', call = result)],
         )
-    @pydantic.validate_call(validate_return = True)
-    def vm_info(self, vm_uuid: uuid.UUID) -> VirtualBoxApiResponse[FullMachineInfo]:
-        get_raw_vm_info_result = self.__execute_call(args = ['showvminfo', str(vm_uuid), '--machinereadable'])
+    def __parse_hdds_list(self, raw_list: str) -> typing.Iterator[HardDiskInfo]:
+        # one block per medium starting with `UUID:`, sizes are reported as `<n> MBytes`
+        raw_hdd_info_dict: dict[str, str] = dict()
+        for line in itertools.chain(raw_list.splitlines(), ['UUID:']):
+            if len(chunks := line.split(':', maxsplit = 1)) != 2:
+                continue
+            (key, value) = (chunks[0], chunks[1].strip())
+            if key == 'UUID':
+                if all(key in raw_hdd_info_dict for key in ('UUID', 'Location', 'Capacity', 'Size on disk')):
+                    yield HardDiskInfo(
+                        uuid = raw_hdd_info_dict['UUID'], location = raw_hdd_info_dict['Location'],
+                        parent_uuid = raw_hdd_info_dict['Parent UUID'] if raw_hdd_info_dict.get('Parent UUID', 'base') != 'base' else None,
+                        capacity_mb = int(raw_hdd_info_dict['Capacity'].split(' ', maxsplit = 1)[0]),
+                        size_on_disk_mb = int(raw_hdd_info_dict['Size on disk'].split(' ', maxsplit = 1)[0]),
+                    )
+                raw_hdd_info_dict = dict()
+            raw_hdd_info_dict.setdefault(key, value)
+    @metrics.instrument_operation
+    @validate_call(validate_return = True)
+    async def vm_info(self, vm_uuid: uuid.UUID, use_cache: bool = True) -> VirtualBoxApiResponse[FullMachineInfo]:
+        if use_cache and (cached_response := self.__cache.get(key = vm_uuid)) is not None:
+            return cached_response
+        get_raw_vm_info_result = await self.__execute_call(stage = 'vm_info.get_raw_vm_info', args = ['showvminfo', str(vm_uuid), '--machinereadable'])
         if get_raw_vm_info_result.status != 0:
             raise VirtualBoxApiError(error_info = get_raw_vm_info_result, stage = 'vm_info.get_raw_vm_info')
         raw_vm_info_dict: dict[str, str] = dict()
@@ -63,115 +238,243 @@ class VirtualBoxApi:
             if len(chunks := line.split('=', maxsplit = 1)) == 2:
                 raw_vm_info_dict[chunks[0]] = chunks[1]
 
-        return VirtualBoxApiResponse[FullMachineInfo](
+        response = VirtualBoxApiResponse[FullMachineInfo](
             payload = FullMachineInfo(
                 is_online = (raw_vm_info_dict['VMState'] == '"running"'),
+                state = raw_vm_info_dict['VMState'][1:-1],
                 vrde_connection = VrdeConnectionInfo(
                     host = raw_vm_info_dict.get('vrdeaddress', '""')[1:-1], 
                     port = int(raw_vm_info_dict.get('vrdeports', '"0"')[1:-1])
-                )
+                ),
+                cpu_count = int(raw_vm_info_dict['cpus']) if raw_vm_info_dict.get('cpus', '').isdigit() else None,
+                memory_mb = int(raw_vm_info_dict['memory']) if raw_vm_info_dict.get('memory', '').isdigit() else None,
             ),
-            logs = [LogEntry(stage = 'vm_info.get_raw_vm_info', call = get_raw_vm_info_result)]
+            logs = [LogEntry(stage = 'vm_info.get_raw_vm_info', call = get_raw_vm_info_result)],
+            operation_id = uuid.uuid4()
         )
+        self.__cache.put(key = vm_uuid, value = response)
+        return response
+
+    @validate_call(validate_return = True)
+    async def __execute_stage(self, stage: str, args: list[str], allowed_statuses: tuple[int, ...] = (0,)) -> LogEntry:
+        result = await self.__execute_call(stage = stage, args = args)
+        if result.status not in allowed_statuses:
+            raise VirtualBoxApiError(error_info = result, stage = stage)
+        return LogEntry(stage = stage, call = result)
+    @validate_call(validate_return = True)
+    async def __setup_machine(self, vm_uuid: uuid.UUID, machine_info: CreateMachineInfo) -> list[LogEntry]:
+        # every stage below locks the machine session, so they can not run concurrently with each other
+        return [
+            await self.__execute_stage(stage = 'create_vm.create_machine', args = ['createvm', '--name', str(vm_uuid), '--uuid', str(vm_uuid), '--ostype', machine_info.os_type, '--basefolder', self.__machines_dir, '--register']),
+            await self.__execute_stage(stage = 'create_vm.create_sata_controller', args = ['storagectl', str(vm_uuid), '--name', 'SATA', '--add', 'sata']),
+            await self.__execute_stage(stage = 'create_vm.create_ide_controller', args = ['storagectl', str(vm_uuid), '--name', 'IDE', '--add', 'ide']),
+        ] + await self.__configure_machine(vm_uuid = vm_uuid, machine_info = machine_info) + [
+            await self.__execute_stage(stage = 'create_vm.attach_image', args = ['storageattach', str(vm_uuid), '--storagectl', 'IDE', '--port', '1', '--device', '0', '--type', 'dvddrive', '--medium', f'{self.__images_dir}/{machine_info.template}.iso']),
+        ]
+    @validate_call(validate_return = True)
+    async def __configure_machine(self, vm_uuid: uuid.UUID, machine_info: CreateMachineInfo) -> list[LogEntry]:
+        return [
+            await self.__execute_stage(stage = 'create_vm.setup_machine_settings', args = [
+                'modifyvm', str(vm_uuid),
+                '--cpus', str(machine_info.hardware.cpu_count), '--memory', str(machine_info.hardware.memory_mb), '--vram', str(machine_info.hardware.vram_mb), '--graphicscontroller', 'vboxsvga', '--accelerate-3d', 'on',
+                '--monitor-count', '1', '--mouse', 'usb', '--keyboard', 'usb',
+                '--recording-video-fps', '60',
+                '--vrde', 'on', '--vrdeauthtype', 'external', '--vrdevideochannel', 'on', '--vrdevideochannelquality', '100',
+            ]),
+            await self.__execute_stage(stage = 'create_vm.setup_vrde_credentials', args = ['setextradata', str(vm_uuid), f'VBoxAuthSimple/users/{machine_info.vrde_credentials.username}', machine_info.vrde_credentials.password_sha256]),
+        ]
+    @validate_call(config = pydantic.ConfigDict(arbitrary_types_allowed = True), validate_return = True)
+    async def __rollback_create_vm(self, vm_uuid: uuid.UUID, drive_path: str, machine_created: bool, drive_created: bool, error: BaseException) -> None:
+        # best effort, the original error is raised to the caller and carries the rollback calls along
+        rollback_logs: list[LogEntry] = []
+        if machine_created:
+            rollback_logs.append(LogEntry(stage = 'create_vm.rollback_machine', call = await self.__execute_call(stage = 'create_vm.rollback_machine', args = ['unregistervm', str(vm_uuid), '--delete'])))
+        if drive_created:
+            rollback_logs.append(LogEntry(stage = 'create_vm.rollback_drive', call = await self.__execute_call(stage = 'create_vm.rollback_drive', args = ['closemedium', 'disk', drive_path, '--delete'])))
+        for entry in rollback_logs:
+            if entry.call.status != 0:
+                logger.warning('%s of machine %s failed with status %d, it may have been left behind: %s', entry.stage, vm_uuid, entry.call.status, entry.call.stderr.strip())
+        if isinstance(error, VirtualBoxApiError):
+            error.rollback_logs.extend(rollback_logs)
 
-    @pydantic.validate_call(validate_return = True)
-    def create_vm(self, machine_info: CreateMachineInfo) -> VirtualBoxApiResponse[uuid.UUID]:
+    @validate_call(validate_return = True)
+    async def __create_from_image(self, vm_uuid: uuid.UUID, machine_info: CreateMachineInfo) -> list[LogEntry]:
+        drive_path = f'{self.__storages_dir}/{vm_uuid}.vdi'
+        # createhd does not touch the machine, so it runs alongside the machine setup stages
+        (setup_machine_logs, create_drive_log) = await asyncio.gather(
+            self.__setup_machine(vm_uuid = vm_uuid, machine_info = machine_info),
+            self.__execute_stage(stage = 'create_vm.create_drive', args = ['createhd', '--filename', drive_path, '--size', str(machine_info.drive.size_gb * 1024), '--format', 'VDI']),
+            return_exceptions = True
+        )
+        if (error := next((result for result in (setup_machine_logs, create_drive_log) if isinstance(result, BaseException)), None)) is not None:
+            await self.__rollback_create_vm(
+                vm_uuid = vm_uuid, drive_path = drive_path,
+                machine_created = not (isinstance(setup_machine_logs, VirtualBoxApiError) and setup_machine_logs.stage == 'create_vm.create_machine'),
+                drive_created = not isinstance(create_drive_log, BaseException), error = error,
+            )
+            raise error
+        try:
+            attach_drive_log = await self.__execute_stage(stage = 'create_vm.attach_drive', args = ['storageattach', str(vm_uuid), '--storagectl', 'SATA', '--port', '0', '--device', '0', '--type', 'hdd', '--medium', drive_path])
+        except VirtualBoxApiError as error:
+            await self.__rollback_create_vm(vm_uuid = vm_uuid, drive_path = drive_path, machine_created = True, drive_created = True, error = error)
+            raise
+        return setup_machine_logs + [create_drive_log, attach_drive_log]
+    @validate_call(validate_return = True)
+    async def __remove_inherited_credentials(self, vm_uuid: uuid.UUID) -> list[LogEntry]:
+        # the clone copies the extradata of the template, its VRDE users would otherwise keep access to every clone
+        list_extradata_log = await self.__execute_stage(stage = 'create_vm.list_extradata', args = ['getextradata', str(vm_uuid), 'enumerate'])
+        usernames = re.findall(r'^Key: VBoxAuthSimple/users/(.*), Value: ', list_extradata_log.call.stdout, flags = re.MULTILINE)
+        # setextradata without a value removes the key
+        return [list_extradata_log] + [
+            await self.__execute_stage(stage = 'create_vm.remove_inherited_credentials', args = ['setextradata', str(vm_uuid), f'VBoxAuthSimple/users/{username}'])
+            for username in usernames
+        ]
+    @validate_call(validate_return = True)
+    async def __create_linked_clone(self, vm_uuid: uuid.UUID, machine_info: CreateMachineInfo) -> list[LogEntry]:
+        # the clone gets a differencing disk on top of the template snapshot, so there is no image to attach and no drive to allocate
+        clone_machine_log = await self.__execute_stage(stage = 'create_vm.clone_machine', args = ['clonevm', machine_info.golden_template.machine, '--snapshot', machine_info.golden_template.snapshot, '--options', 'link', '--name', str(vm_uuid), '--uuid', str(vm_uuid), '--basefolder', self.__machines_dir, '--register'])
+        try:
+            return [clone_machine_log] + await self.__remove_inherited_credentials(vm_uuid = vm_uuid) + await self.__configure_machine(vm_uuid = vm_uuid, machine_info = machine_info)
+        except VirtualBoxApiError as error:
+            await self.__rollback_create_vm(vm_uuid = vm_uuid, drive_path = '', machine_created = True, drive_created = False, error = error)
+            raise
+
+    @metrics.instrument_operation
+    @validate_call(validate_return = True)
+    async def create_vm(self, machine_info: CreateMachineInfo) -> VirtualBoxApiResponse[uuid.UUID]:
         vm_uuid = uuid.uuid4()
 
-        create_machine_result = self.__execute_call(args = ['createvm', '--name', str(vm_uuid), '--uuid', str(vm_uuid), '--ostype', machine_info.os_type, '--basefolder', self.__machines_dir, '--register'])
-        if create_machine_result.status != 0:
-            raise VirtualBoxApiError(error_info = create_machine_result, stage = 'create_vm.create_machine')
-        create_sata_controller_result = self.__execute_call(args = ['storagectl', str(vm_uuid), '--name', 'SATA', '--add', 'sata'])
-        if create_sata_controller_result.status != 0:
-            raise VirtualBoxApiError(error_info = create_sata_controller_result, stage = 'create_vm.create_sata_controller')
-        create_ide_controller_result = self.__execute_call(args = ['storagectl', str(vm_uuid), '--name', 'IDE', '--add', 'ide'])
-        if create_ide_controller_result.status != 0:
-            raise VirtualBoxApiError(error_info = create_ide_controller_result, stage = 'create_vm.create_ide_controller')
-        
-        setup_internal_hardware_result = self.__execute_call(args = ['modifyvm', str(vm_uuid), '--cpus', str(machine_info.hardware.cpu_count), '--memory', str(machine_info.hardware.memory_mb), '--vram', str(machine_info.hardware.vram_mb), '--graphicscontroller', 'vboxsvga', '--accelerate-3d', 'on'])
-        if setup_internal_hardware_result.status != 0:
-            raise VirtualBoxApiError(error_info = setup_internal_hardware_result, stage = 'create_vm.setup_internal_hardware')
-        setup_external_hardware_result = self.__execute_call(args = ['modifyvm', str(vm_uuid), '--monitor-count', '1', '--mouse', 'usb', '--keyboard', 'usb'])
-        if setup_external_hardware_result.status != 0:
-            raise VirtualBoxApiError(error_info = setup_external_hardware_result, stage = 'create_vm.setup_external_hardware')
-        setup_video_fps_result = self.__execute_call(args = ['modifyvm', str(vm_uuid), '--recording-video-fps', '60'])
-        if setup_video_fps_result.status != 0:
-            raise VirtualBoxApiError(error_info = setup_video_fps_result, stage = 'create_vm.setup_video_fps')
-        
-        setup_vrde_settings_result = self.__execute_call(args = ['modifyvm', str(vm_uuid), '--vrde', 'on', '--vrdeauthtype', 'external', '--vrdevideochannel', 'on', '--vrdevideochannelquality', '100'])
-        if setup_vrde_settings_result.status != 0:
-            raise VirtualBoxApiError(error_info = setup_vrde_settings_result, stage = 'create_vm.setup_vrde_settings')
-        setup_vrde_credentials_result = self.__execute_call(args = ['setextradata', str(vm_uuid), f'VBoxAuthSimple/users/{machine_info.vrde_credentials.username}', hashlib.sha256(machine_info.vrde_credentials.password.encode('utf-8')).hexdigest()])
-        if setup_vrde_credentials_result.status != 0:
-            raise VirtualBoxApiError(error_info = setup_vrde_credentials_result, stage = 'create_vm.setup_vrde_credentials_result')
+        drive_path = f'{self.__storages_dir}/{vm_uuid}.vdi'
+        async with self.__lock_vm(vm_uuid = vm_uuid):
+            try:
+                if machine_info.golden_template is not None:
+                    logs = await self.__create_linked_clone(vm_uuid = vm_uuid, machine_info = machine_info)
+                else:
+                    logs = await self.__create_from_image(vm_uuid = vm_uuid, machine_info = machine_info)
+                if machine_info.clean_snapshot:
+                    try:
+                        logs.append(await self.__execute_stage(stage = 'create_vm.take_clean_snapshot', args = ['snapshot', str(vm_uuid), 'take', self.CLEAN_SNAPSHOT]))
+                    except VirtualBoxApiError as error:
+                        # the drive is attached by now, unregistervm deletes it along with the machine
+                        await self.__rollback_create_vm(vm_uuid = vm_uuid, drive_path = drive_path, machine_created = True, drive_created = False, error = error)
+                        raise
+            except asyncio.CancelledError as error:
+                # the stages roll back their own failures, a cancellation may land between any two of them and leave both behind,
+                # the rollback is shielded so that a shutdown waiting on this task does not cut it short
+                await asyncio.shield(self.__rollback_create_vm(vm_uuid = vm_uuid, drive_path = drive_path, machine_created = True, drive_created = machine_info.golden_template is None, error = error))
+                raise
+            finally:
+                self.__cache.invalidate('list_vms', 'list_vms_info')
+
+        return VirtualBoxApiResponse[uuid.UUID](payload = vm_uuid, logs = logs)
+    @metrics.instrument_operation
+    @validate_call(validate_return = True)
+    async def set_vrde_credentials(self, vm_uuid: uuid.UUID, vrde_credentials: CreateMachineInfo.VrdeCredentialsInfo, previous_username: str | None = None) -> VirtualBoxApiResponse[None]:
+        logs: list[LogEntry] = []
+        async with self.__lock_vm(vm_uuid = vm_uuid):
+            if previous_username is not None:
+                # setextradata without a value removes the key
+                logs.append(await self.__execute_stage(stage = 'set_vrde_credentials.remove_previous_credentials', args = ['setextradata', str(vm_uuid), f'VBoxAuthSimple/users/{previous_username}']))
+            logs.append(await self.__execute_stage(stage = 'set_vrde_credentials.setup_vrde_credentials', args = ['setextradata', str(vm_uuid), f'VBoxAuthSimple/users/{vrde_credentials.username}', vrde_credentials.password_sha256]))
+
+        return VirtualBoxApiResponse[None](payload = None, logs = logs)
+    @metrics.instrument_operation
+    @validate_call(validate_return = True)
+    async def take_clean_snapshot(self, vm_uuid: uuid.UUID) -> VirtualBoxApiResponse[None]:
+        async with self.__lock_vm(vm_uuid = vm_uuid):
+            # snapshot names are not unique in VirtualBox, the previous clean one goes first so a reset is never ambiguous
+            (list_snapshots_log, snapshot_names) = await self.__list_snapshots(vm_uuid = vm_uuid, stage = 'take_clean_snapshot.list_snapshots')
+            logs = [list_snapshots_log]
+            if self.CLEAN_SNAPSHOT in snapshot_names:
+                logs.append(await self.__execute_stage(stage = 'take_clean_snapshot.remove_previous_snapshot', args = ['snapshot', str(vm_uuid), 'delete', self.CLEAN_SNAPSHOT]))
+            logs.append(await self.__execute_stage(stage = 'take_clean_snapshot.take_snapshot', args = ['snapshot', str(vm_uuid), 'take', self.CLEAN_SNAPSHOT]))
+
+        return VirtualBoxApiResponse[None](payload = None, logs = logs)
+    @validate_call(validate_return = True)
+    async def __list_snapshots(self, vm_uuid: uuid.UUID, stage: str) -> tuple[LogEntry, list[str]]:
+        result = await self.__execute_call(stage = stage, args = ['snapshot', str(vm_uuid), 'list', '--machinereadable'])
+        # a machine without snapshots makes the listing exit with 1 as well
+        if result.status != 0 and 'does not have any snapshots' not in result.stdout + result.stderr:
+            raise VirtualBoxApiError(error_info = result, stage = stage)
+        return (LogEntry(stage = stage, call = result), re.findall(r'^SnapshotName(?:-[\d-]+)?="(.*)"$', result.stdout, flags = re.MULTILINE))
+    @metrics.instrument_operation
+    @validate_call(validate_return = True)
+    async def reset_vm(self, vm_uuid: uuid.UUID, start: bool = False) -> VirtualBoxApiResponse[VrdeConnectionInfo | None]:
+        async with self.__lock_vm(vm_uuid = vm_uuid):
+            # a machine without a clean snapshot is left running, powering it off could not be undone
+            (list_snapshots_log, snapshot_names) = await self.__list_snapshots(vm_uuid = vm_uuid, stage = 'reset_vm.list_snapshots')
+            if self.CLEAN_SNAPSHOT not in snapshot_names:
+                raise NoCleanSnapshotError(f'Machine {vm_uuid} has no {self.CLEAN_SNAPSHOT} snapshot to reset to, take one first')
+            try:
+                # the guest state is thrown away, so there is nothing to shut down gracefully
+                logs = [
+                    list_snapshots_log,
+                    await self.__execute_stage(stage = 'reset_vm.power_off', args = ['controlvm', str(vm_uuid), 'poweroff'], allowed_statuses = (0, 1)),
+                    # only the differencing disk is discarded, extradata such as the vrde credentials is not part of a snapshot
+                    await self.__execute_stage(stage = 'reset_vm.restore_snapshot', args = ['snapshot', str(vm_uuid), 'restore', self.CLEAN_SNAPSHOT]),
+                ]
+            finally:
+                self.__cache.invalidate(vm_uuid, 'list_vms_info')
+        if not start:
+            return VirtualBoxApiResponse[VrdeConnectionInfo | None](payload = None, logs = logs)
+        start_response = await self.start_vm(vm_uuid = vm_uuid)
+        return VirtualBoxApiResponse[VrdeConnectionInfo | None](payload = start_response.payload, logs = logs + start_response.logs)
+    @metrics.instrument_operation
+    @validate_call(validate_return = True)
+    async def delete_vm(self, vm_uuid: uuid.UUID) -> VirtualBoxApiResponse[None]:
+        async with self.__lock_vm(vm_uuid = vm_uuid):
+            result = await self.__execute_call(stage = 'delete_vm.root', args = ['unregistervm', str(vm_uuid), '--delete'])
+            self.__cache.invalidate(vm_uuid, 'list_vms', 'list_vms_info')
+            self.__vrde_ports.pop(vm_uuid, None)
+            if result.status != 0:
+                raise VirtualBoxApiError(error_info = result, stage = 'delete_vm.root')
+
+            return VirtualBoxApiResponse[None](
+                payload = None, logs = [LogEntry(stage = 'delete_vm.root', call = result)]
+            )
+    @metrics.instrument_operation
+    @validate_call(validate_return = True)
+    async def start_vm(self, vm_uuid: uuid.UUID) -> VirtualBoxApiResponse[VrdeConnectionInfo]:
+        async with self.__lock_vm(vm_uuid = vm_uuid):
+            get_vm_info_result = await self.vm_info(vm_uuid = vm_uuid)
+            if get_vm_info_result.payload.is_online:
+                return VirtualBoxApiResponse[VrdeConnectionInfo](
+                    payload = get_vm_info_result.payload.vrde_connection,
+                    logs = get_vm_info_result.logs
+                )
+
+            get_vm_info_result.payload.vrde_connection.host = self.__advertised_host
+            get_vm_info_result.payload.vrde_connection.port = await self.__pick_vrde_port(vm_uuid = vm_uuid)
+            self.__cache.invalidate(vm_uuid, 'list_vms_info')
+            setup_vrde_network_settings_result = await self.__execute_call(stage = 'start_vm.setup_vrde_network_settings', args = ['modifyvm', str(vm_uuid), '--vrdeaddress', get_vm_info_result.payload.vrde_connection.host, '--vrdeport', str(get_vm_info_result.payload.vrde_connection.port)])
+            if setup_vrde_network_settings_result.status != 0:
+                raise VirtualBoxApiError(error_info = setup_vrde_network_settings_result, stage = 'start_vm.setup_vrde_network_settings')
         
-        attach_image_result = self.__execute_call(args = ['storageattach', str(vm_uuid), '--storagectl', 'IDE', '--port', '1', '--device', '0', '--type', 'dvddrive', '--medium', f'{self.__images_dir}/{machine_info.template}.iso'])
-        if attach_image_result.status != 0:
-            raise VirtualBoxApiError(error_info = attach_image_result, stage = 'create_vm.attach_image')
-        create_drive_result = self.__execute_call(args = ['createhd', '--filename', f'{self.__storages_dir}/{vm_uuid}.vdi', '--size', str(machine_info.drive.size_gb * 1024 * 1024), '--format', 'VDI'])
-        if create_drive_result.status != 0:
-            raise VirtualBoxApiError(error_info = create_drive_result, stage = 'create_vm.create_drive')
-        attach_drive_result = self.__execute_call(args = ['storageattach', str(vm_uuid), '--storagectl', 'SATA', '--port', '0', '--device', '0', '--type', 'hdd', '--medium', f'{self.__storages_dir}/{vm_uuid}.vdi'])
-        if attach_drive_result.status != 0:
-            raise VirtualBoxApiError(error_info = attach_drive_result, stage = 'create_vm.attach_drive')
-
-        return VirtualBoxApiResponse[uuid.UUID](
-            payload = vm_uuid,
-            logs = [
-                LogEntry(stage = 'create_vm.create_machine_result', call = create_machine_result),
-                LogEntry(stage = 'create_vm.create_sata_controller_result', call = create_sata_controller_result),
-                LogEntry(stage = 'create_vm.create_ide_controller_result', call = create_ide_controller_result),
-                LogEntry(stage = 'create_vm.setup_internal_hardware_result', call = setup_internal_hardware_result),
-                LogEntry(stage = 'create_vm.setup_external_hardware_result', call = setup_external_hardware_result),
-                LogEntry(stage = 'create_vm.setup_video_fps_result', call = setup_video_fps_result),
-                LogEntry(stage = 'create_vm.setup_vrde_settings_result', call = setup_vrde_settings_result),
-                LogEntry(stage = 'create_vm.setup_vrde_credentials_result', call = setup_vrde_credentials_result),
-                LogEntry(stage = 'create_vm.attach_image_result', call = attach_image_result),
-                LogEntry(stage = 'create_vm.create_drive_result', call = create_drive_result),
-                LogEntry(stage = 'create_vm.attach_drive_result', call = attach_drive_result),
-            ]
-        )
-    @pydantic.validate_call(validate_return = True)
-    def delete_vm(self, vm_uuid: uuid.UUID) -> VirtualBoxApiResponse[None]:
-        result = self.__execute_call(args = ['unregistervm', str(vm_uuid), '--delete'])
-        if result.status != 0:
-            raise VirtualBoxApiError(error_info = result, stage = 'delete_vm.root')
+            start_machine_result = await self.__execute_call(stage = 'start_vm.start_machine', args = ['startvm', str(vm_uuid), '--type', 'headless'])
+            if start_machine_result.status != 0 and start_machine_result.status != 1: # return 1 where machine already run
+                raise VirtualBoxApiError(error_info = start_machine_result, stage = 'start_vm.start_machine')
+            self.__cache.put(key = vm_uuid, value = VirtualBoxApiResponse[FullMachineInfo](
+                # served as a `vm_info` response, which made no showvminfo call of its own
+                payload = get_vm_info_result.payload.model_copy(update = {'is_online': True, 'state': 'running'}),
+                logs = []
+            ))
 
-        return VirtualBoxApiResponse[None](
-            payload = None, logs = [LogEntry(stage = 'delete_vm.root', call = result)]
-        )
-    @pydantic.validate_call(validate_return = True)
-    def start_vm(self, vm_uuid: uuid.UUID) -> VirtualBoxApiResponse[VrdeConnectionInfo]:
-        get_vm_info_result = self.vm_info(vm_uuid = vm_uuid)
-        if get_vm_info_result.payload.is_online:
             return VirtualBoxApiResponse[VrdeConnectionInfo](
                 payload = get_vm_info_result.payload.vrde_connection,
-                logs = get_vm_info_result.logs
+                logs = get_vm_info_result.logs + [
+                    LogEntry(stage = 'start_vm.setup_vrde_network_settings', call = setup_vrde_network_settings_result),
+                    LogEntry(stage = 'start_vm.start_machine', call = start_machine_result),
+                ]
             )
+    @metrics.instrument_operation
+    @validate_call(validate_return = True)
+    async def stop_vm(self, vm_uuid: uuid.UUID) -> VirtualBoxApiResponse[None]:
+        async with self.__lock_vm(vm_uuid = vm_uuid):
+            result = await self.__execute_call(stage = 'stop_vm.root', args = ['controlvm', str(vm_uuid), 'poweroff'])
+            self.__cache.invalidate(vm_uuid, 'list_vms_info')
+            if result.status != 0 and result.status != 1: # return 1 where machine already stop
+                raise VirtualBoxApiError(error_info = result, stage = 'stop_vm.root')
 
-        get_vm_info_result.payload.vrde_connection.host = self.__advertised_host
-        get_vm_info_result.payload.vrde_connection.port = self.__get_free_port(host = get_vm_info_result.payload.vrde_connection.host)
-        setup_vrde_network_settings_result = self.__execute_call(args = ['modifyvm', str(vm_uuid), '--vrdeaddress', get_vm_info_result.payload.vrde_connection.host, '--vrdeport', str(get_vm_info_result.payload.vrde_connection.port)])
-        if setup_vrde_network_settings_result.status != 0:
-            raise VirtualBoxApiError(error_info = setup_vrde_network_settings_result, stage = 'start_vm.setup_vrde_network_settings')
-        
-        start_machine_result = self.__execute_call(args = ['startvm', str(vm_uuid), '--type', 'headless'])
-        if start_machine_result.status != 0 and start_machine_result.status != 1: # return 1 where machine already run
-            raise VirtualBoxApiError(error_info = start_machine_result, stage = 'start_vm.start_machine')
-
-        return VirtualBoxApiResponse[VrdeConnectionInfo](
-            payload = get_vm_info_result.payload.vrde_connection,
-            logs = get_vm_info_result.logs + [
-                LogEntry(stage = 'start_vm.setup_vrde_network_settings', call = setup_vrde_network_settings_result),
-                LogEntry(stage = 'start_vm.start_machine', call = start_machine_result),
-            ]
-        )
-    @pydantic.validate_call(validate_return = True)
-    def stop_vm(self, vm_uuid: uuid.UUID) -> VirtualBoxApiResponse[None]:
-        result = self.__execute_call(args = ['controlvm', str(vm_uuid), 'poweroff'])
-        if result.status != 0 and result.status != 1: # return 1 where machine already stop
-            raise VirtualBoxApiError(error_info = result, stage = 'stop_vm.root')
-
-        return VirtualBoxApiResponse[None](
-            payload = None, logs = [LogEntry(stage = 'stop_vm.root', call = result)]
-        )
+            return VirtualBoxApiResponse[None](
+                payload = None, logs = [LogEntry(stage = 'stop_vm.root', call = result)]
+            )
@@ -0,0 +1,91 @@
+from domain.machines.models import VBoxManageCallResult, VBoxManageOutputEvent
+from domain.validation import validate_call
+from domain.machines import metrics
+import subprocess
+import asyncio
+import codecs
+import typing
+import abc
+
+
+class AbstractVBoxManageBackend(abc.ABC):
+    @abc.abstractmethod
+    @validate_call(validate_return = True)
+    def execute(self, args: list[str]) -> VBoxManageCallResult:
+        raise NotImplementedError(f'{type(self)}.execute')
+    @validate_call(validate_return = True)
+    async def execute_async(self, args: list[str]) -> VBoxManageCallResult:
+        return await asyncio.to_thread(self.execute, args = args)
+    async def stream_async(self, args: list[str]) -> typing.AsyncIterator[VBoxManageOutputEvent]:
+        # backends without real pipes hand out the whole output at once
+        result = await self.execute_async(args = args)
+        if result.stdout:
+            yield VBoxManageOutputEvent(kind = 'stdout', data = result.stdout)
+        if result.stderr:
+            yield VBoxManageOutputEvent(kind = 'stderr', data = result.stderr)
+        yield VBoxManageOutputEvent(kind = 'exit', status = result.status)
+    @validate_call(validate_return = True)
+    def close(self) -> None:
+        pass
+
+
+class SubprocessVBoxManageBackend(AbstractVBoxManageBackend):
+    STREAM_CHUNK_SIZE: typing.ClassVar[int] = 64 * 1024
+
+    @validate_call(validate_return = True)
+    def __init__(self, vboxmanage_bin: str = 'VBoxManage') -> None:
+        self.__vboxmanage_bin: str = vboxmanage_bin
+    @validate_call(validate_return = True)
+    def execute(self, args: list[str]) -> VBoxManageCallResult:
+        metrics.PROCESS_SPAWNS.inc()
+        raw_result = subprocess.run(args = [self.__vboxmanage_bin] + args, capture_output = True)
+        return VBoxManageCallResult(
+            status = raw_result.returncode,
+            stdout = raw_result.stdout,
+            stderr = raw_result.stderr,
+            args = raw_result.args,
+        )
+    @validate_call(validate_return = True)
+    async def execute_async(self, args: list[str]) -> VBoxManageCallResult:
+        metrics.PROCESS_SPAWNS.inc()
+        process = await asyncio.create_subprocess_exec(self.__vboxmanage_bin, *args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        try:
+            (stdout, stderr) = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+        return VBoxManageCallResult(
+            status = process.returncode,
+            stdout = stdout,
+            stderr = stderr,
+            args = [self.__vboxmanage_bin] + args,
+        )
+    async def stream_async(self, args: list[str]) -> typing.AsyncIterator[VBoxManageOutputEvent]:
+        metrics.PROCESS_SPAWNS.inc()
+        process = await asyncio.create_subprocess_exec(self.__vboxmanage_bin, *args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        # bounded so that a slow consumer throttles the pipes instead of buffering in memory
+        events: asyncio.Queue[VBoxManageOutputEvent | None] = asyncio.Queue(maxsize = 16)
+        async def pump(kind: typing.Literal['stdout', 'stderr'], reader: asyncio.StreamReader) -> None:
+            decoder = codecs.getincrementaldecoder('utf-8')(errors = 'replace')
+            while chunk := await reader.read(self.STREAM_CHUNK_SIZE):
+                if data := decoder.decode(chunk):
+                    await events.put(VBoxManageOutputEvent(kind = kind, data = data))
+            if data := decoder.decode(b'', final = True):
+                await events.put(VBoxManageOutputEvent(kind = kind, data = data))
+            await events.put(None)
+        pumps = [asyncio.create_task(pump(kind = 'stdout', reader = process.stdout)), asyncio.create_task(pump(kind = 'stderr', reader = process.stderr))]
+        try:
+            finished_pumps = 0
+            while finished_pumps < len(pumps):
+                if (event := await events.get()) is None:
+                    finished_pumps += 1
+                else:
+                    yield event
+            yield VBoxManageOutputEvent(kind = 'exit', status = await process.wait())
+        finally:
+            for task in pumps:
+                task.cancel()
+            # the consumer went away or timed out before the process finished
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
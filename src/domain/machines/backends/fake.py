@@ -0,0 +1,284 @@
+from domain.machines.backends import AbstractVBoxManageBackend
+from domain.machines.models import VBoxManageCallResult
+from domain.validation import validate_call
+import threading
+import copy
+import typing
+import uuid
+
+
+class FakeVBoxManageError(Exception):
+    pass
+
+
+class FakeVBoxManageBackend(AbstractVBoxManageBackend):
+    # flags which never take a value, everything else starting with '--' is an option with a value
+    FLAGS: typing.ClassVar[set[str]] = {'--nologo', '--register', '--delete', '--machinereadable', '--long', '--wait-stdout', '--wait-stderr', '--verbose'}
+    LONG_LIST_STATES: typing.ClassVar[dict[str, str]] = {'poweroff': 'powered off', 'gurumeditation': 'guru meditation', 'abortedsaved': 'aborted-saved', 'livesnapshotting': 'live snapshotting'}
+
+    @validate_call(validate_return = True)
+    def __init__(self, state: dict[str, typing.Any] | None = None) -> None:
+        self.__state: dict[str, typing.Any] = state if state is not None else dict()
+        self.__state.setdefault('machines', dict())
+        self.__state.setdefault('disks', dict())
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self) -> dict[str, typing.Any]:
+        return self.__state
+
+    @validate_call(validate_return = True)
+    def execute(self, args: list[str]) -> VBoxManageCallResult:
+        with self.__lock:
+            try:
+                return VBoxManageCallResult(args = ['VBoxManage'] + args, status = 0, stdout = self.__dispatch(args = [arg for arg in args if arg != '--nologo']), stderr = '')
+            except FakeVBoxManageError as error:
+                return VBoxManageCallResult(args = ['VBoxManage'] + args, status = 1, stdout = '', stderr = f'VBoxManage: error: {error}\n')
+
+    def __dispatch(self, args: list[str]) -> str:
+        if len(args) == 0:
+            raise FakeVBoxManageError('No command given')
+        if (handler := getattr(self, f'_command_{args[0]}', None)) is None:
+            raise FakeVBoxManageError(f'Unknown command \'{args[0]}\'')
+        (positionals, options) = self.__parse_args(args = args[1:])
+        return handler(positionals, options)
+    def __parse_args(self, args: list[str]) -> tuple[list[str], dict[str, str]]:
+        positionals: list[str] = []
+        options: dict[str, str] = dict()
+        index = 0
+        while index < len(args):
+            if args[index] == '--':
+                options['--'] = '\0'.join(args[index + 1:])
+                break
+            if args[index] in self.FLAGS:
+                options[args[index]] = ''
+            elif args[index].startswith('--'):
+                if index + 1 >= len(args):
+                    raise FakeVBoxManageError(f'Missing value for option \'{args[index]}\'')
+                options[args[index]] = args[index + 1]
+                index += 1
+            else:
+                positionals.append(args[index])
+            index += 1
+        return (positionals, options)
+    def __find_machine(self, name_or_uuid: str) -> dict[str, typing.Any]:
+        for machine in self.__state['machines'].values():
+            if name_or_uuid in (machine['uuid'], machine['name']):
+                return machine
+        raise FakeVBoxManageError(f'Could not find a registered machine named \'{name_or_uuid}\'')
+    def __require_option(self, options: dict[str, str], name: str) -> str:
+        if name not in options:
+            raise FakeVBoxManageError(f'Parameter {name} is required')
+        return options[name]
+
+    def _command_list(self, positionals: list[str], options: dict[str, str]) -> str:
+        if positionals[0:1] == ['hdds']:
+            return '\n'.join(self.__format_hdd_info(filename = filename, disk = disk) for (filename, disk) in self.__state['disks'].items())
+        if positionals[0:1] == ['vms']:
+            machines = list(self.__state['machines'].values())
+        elif positionals[0:1] == ['runningvms']:
+            machines = [machine for machine in self.__state['machines'].values() if machine['state'] == 'running']
+        else:
+            raise FakeVBoxManageError(f'Unknown list type {positionals[0:1]}')
+        if '--long' in options:
+            return '\n'.join(self.__format_long_vm_info(machine = machine) for machine in machines)
+        return ''.join(f'"{machine['name']}" {{{machine['uuid']}}}\n' for machine in machines)
+    def __format_hdd_info(self, filename: str, disk: dict[str, typing.Any]) -> str:
+        parent = self.__state['disks'].get(disk.get('parent', ''))
+        lines = [
+            ('UUID', disk['uuid']),
+            ('Parent UUID', parent['uuid'] if parent is not None else 'base'),
+            ('State', 'created'),
+            ('Type', 'normal (differencing)' if parent is not None else 'normal (base)'),
+            ('Location', filename),
+            ('Storage format', 'VDI'),
+            ('Capacity', f'{disk['size_mb']} MBytes'),
+            # dynamically allocated, nothing is ever written to a fake disk
+            ('Size on disk', '2 MBytes'),
+            ('Encryption', 'disabled'),
+        ]
+        return ''.join(f'{f'{key}:':<16}{value}\n' for (key, value) in lines)
+    def __format_long_vm_info(self, machine: dict[str, typing.Any]) -> str:
+        settings = machine['settings']
+        vrde = 'disabled'
+        if settings.get('--vrde', 'off') == 'on':
+            vrde = f'enabled (Address {settings.get('--vrdeaddress') or '0.0.0.0'}, Ports {settings.get('--vrdeport', '3389')}, MultiConn: off, ReuseSingleConn: off, Authentication type: {settings.get('--vrdeauthtype', 'null')})'
+        lines = [
+            ('Name', machine['name']),
+            ('Groups', '/'),
+            ('Guest OS', machine['ostype']),
+            ('UUID', machine['uuid']),
+            ('Config file', f'{machine['basefolder']}/{machine['name']}/{machine['name']}.vbox'),
+            ('Memory size', f'{settings.get('--memory', '128')}MB'),
+            ('VRAM size', f'{settings.get('--vram', '8')}MB'),
+            ('Number of CPUs', settings.get('--cpus', '1')),
+            ('State', f'{self.LONG_LIST_STATES.get(machine['state'], machine['state'])} (since 2000-01-01T00:00:00.000000000)'),
+            ('VRDE', vrde),
+        ]
+        return ''.join(f'{f'{key}:':<29}{value}\n' for (key, value) in lines)
+    def _command_showvminfo(self, positionals: list[str], options: dict[str, str]) -> str:
+        machine = self.__find_machine(name_or_uuid = positionals[0])
+        settings = machine['settings']
+        lines = [
+            f'name="{machine['name']}"',
+            f'UUID="{machine['uuid']}"',
+            f'ostype="{machine['ostype']}"',
+            f'CfgFile="{machine['basefolder']}/{machine['name']}/{machine['name']}.vbox"',
+            f'memory={settings.get('--memory', '128')}',
+            f'vram={settings.get('--vram', '8')}',
+            f'cpus={settings.get('--cpus', '1')}',
+            f'VMState="{machine['state']}"',
+            f'vrde="{settings.get('--vrde', 'off')}"',
+            f'vrdeports="{settings.get('--vrdeport', '3389')}"',
+            f'vrdeaddress="{settings.get('--vrdeaddress', '')}"',
+        ]
+        for (index, (controller_name, controller_type)) in enumerate(machine['controllers'].items()):
+            lines += [f'storagecontrollername{index}="{controller_name}"', f'storagecontrollertype{index}="{controller_type}"']
+        for (slot, attachment) in machine['attachments'].items():
+            lines.append(f'"{slot}"="{attachment['medium']}"')
+        return ''.join(f'{line}\n' for line in lines)
+
+    def _command_createvm(self, positionals: list[str], options: dict[str, str]) -> str:
+        vm_uuid = str(uuid.UUID(options.get('--uuid', str(uuid.uuid4()))))
+        name = self.__require_option(options = options, name = '--name')
+        if vm_uuid in self.__state['machines'] or any(machine['name'] == name for machine in self.__state['machines'].values()):
+            raise FakeVBoxManageError(f'Machine \'{name}\' already exists')
+        if '--register' not in options:
+            raise FakeVBoxManageError('Only registered machines are supported')
+        self.__state['machines'][vm_uuid] = {
+            'uuid': vm_uuid, 'name': name, 'ostype': options.get('--ostype', 'Other'), 'basefolder': options.get('--basefolder', ''),
+            'state': 'poweroff', 'settings': dict(), 'extradata': dict(), 'controllers': dict(), 'attachments': dict(), 'snapshots': dict(),
+        }
+        return f'Virtual machine \'{name}\' is created and registered.\nUUID: {vm_uuid}\n'
+    def _command_clonevm(self, positionals: list[str], options: dict[str, str]) -> str:
+        source = self.__find_machine(name_or_uuid = positionals[0])
+        if options.get('--options') != 'link':
+            raise FakeVBoxManageError('Only linked clones are supported')
+        if (snapshot := source['snapshots'].get(self.__require_option(options = options, name = '--snapshot'))) is None:
+            raise FakeVBoxManageError(f'Could not find a snapshot named \'{options['--snapshot']}\'')
+        self._command_createvm(positionals = [], options = {'--name': options.get('--name', f'{source['name']} Clone'), '--uuid': options.get('--uuid', str(uuid.uuid4())), '--ostype': source['ostype'], '--basefolder': options.get('--basefolder', source['basefolder']), '--register': ''})
+        machine = self.__find_machine(name_or_uuid = options.get('--uuid', options.get('--name', f'{source['name']} Clone')))
+        for key in ('settings', 'extradata', 'controllers', 'attachments'):
+            machine[key] = copy.deepcopy(snapshot[key])
+        for (slot, attachment) in snapshot['attachments'].items():
+            if attachment['type'] == 'hdd':
+                # differencing disk on top of the snapshot one
+                machine['attachments'][slot]['medium'] = f'{machine['basefolder']}/{machine['name']}/Snapshots/{{{uuid.uuid4()}}}.vdi'
+                self.__state['disks'][machine['attachments'][slot]['medium']] = {'uuid': str(uuid.uuid4()), 'size_mb': self.__state['disks'].get(attachment['medium'], {}).get('size_mb', 0), 'parent': attachment['medium']}
+        return f'Machine has been successfully cloned as "{machine['name']}"\n'
+    def _command_snapshot(self, positionals: list[str], options: dict[str, str]) -> str:
+        machine = self.__find_machine(name_or_uuid = positionals[0])
+        match positionals[1:]:
+            case ['take', name]:
+                if name in machine['snapshots']:
+                    raise FakeVBoxManageError(f'Snapshot \'{name}\' already exists')
+                machine['snapshots'][name] = {key: copy.deepcopy(machine[key]) for key in ('settings', 'extradata', 'controllers', 'attachments')}
+                return f'Snapshot taken. UUID: {uuid.uuid4()}\n'
+            case ['restore', name]:
+                if name not in machine['snapshots']:
+                    raise FakeVBoxManageError(f'Could not find a snapshot named \'{name}\'')
+                if machine['state'] == 'running':
+                    raise FakeVBoxManageError(f'Cannot restore a snapshot of the machine \'{machine['name']}\' while it is running')
+                # extradata lives in the machine settings file and is not part of a snapshot, like in VirtualBox
+                for key in ('settings', 'controllers', 'attachments'):
+                    machine[key] = copy.deepcopy(machine['snapshots'][name][key])
+                return f'Restoring snapshot \'{name}\'\n'
+            case ['delete', name]:
+                if machine['snapshots'].pop(name, None) is None:
+                    raise FakeVBoxManageError(f'Could not find a snapshot named \'{name}\'')
+                return ''
+            case ['list']:
+                if not machine['snapshots']:
+                    raise FakeVBoxManageError('This machine does not have any snapshots')
+                # snapshots are kept flat here, each one is listed as a child of the previous one
+                return ''.join(f'SnapshotName{''.join('-1' for _ in range(index))}="{name}"\n' for (index, name) in enumerate(machine['snapshots']))
+        raise FakeVBoxManageError(f'Unsupported snapshot action {positionals[1:]}')
+    def _command_unregistervm(self, positionals: list[str], options: dict[str, str]) -> str:
+        machine = self.__find_machine(name_or_uuid = positionals[0])
+        if machine['state'] == 'running':
+            raise FakeVBoxManageError(f'Cannot unregister the machine \'{machine['name']}\' while it is locked')
+        if '--delete' in options:
+            for attachment in machine['attachments'].values():
+                if attachment['type'] == 'hdd':
+                    self.__state['disks'].pop(attachment['medium'], None)
+        del self.__state['machines'][machine['uuid']]
+        return ''
+    def _command_modifyvm(self, positionals: list[str], options: dict[str, str]) -> str:
+        machine = self.__find_machine(name_or_uuid = positionals[0])
+        if machine['state'] == 'running':
+            raise FakeVBoxManageError(f'The machine \'{machine['name']}\' is already locked for a session (or being unlocked)')
+        machine['settings'].update(options)
+        return ''
+    def _command_getextradata(self, positionals: list[str], options: dict[str, str]) -> str:
+        machine = self.__find_machine(name_or_uuid = positionals[0])
+        if positionals[1] == 'enumerate':
+            return ''.join(f'Key: {key}, Value: {value}\n' for (key, value) in machine['extradata'].items())
+        if positionals[1] not in machine['extradata']:
+            return 'No value set!\n'
+        return f'Value: {machine["extradata"][positionals[1]]}\n'
+    def _command_setextradata(self, positionals: list[str], options: dict[str, str]) -> str:
+        machine = self.__find_machine(name_or_uuid = positionals[0])
+        if len(positionals) > 2:
+            machine['extradata'][positionals[1]] = positionals[2]
+        else:
+            machine['extradata'].pop(positionals[1], None)
+        return ''
+    def _command_storagectl(self, positionals: list[str], options: dict[str, str]) -> str:
+        machine = self.__find_machine(name_or_uuid = positionals[0])
+        name = self.__require_option(options = options, name = '--name')
+        if name in machine['controllers']:
+            raise FakeVBoxManageError(f'Storage controller named \'{name}\' already exists')
+        machine['controllers'][name] = self.__require_option(options = options, name = '--add')
+        return ''
+    def _command_storageattach(self, positionals: list[str], options: dict[str, str]) -> str:
+        machine = self.__find_machine(name_or_uuid = positionals[0])
+        controller = self.__require_option(options = options, name = '--storagectl')
+        if controller not in machine['controllers']:
+            raise FakeVBoxManageError(f'Could not find a controller named \'{controller}\'')
+        slot = f'{controller}-{options.get('--port', '0')}-{options.get('--device', '0')}'
+        if (medium := self.__require_option(options = options, name = '--medium')) == 'none':
+            machine['attachments'].pop(slot, None)
+            return ''
+        if (medium_type := options.get('--type', 'hdd')) == 'hdd' and medium not in self.__state['disks']:
+            raise FakeVBoxManageError(f'Could not find file for the medium \'{medium}\'')
+        machine['attachments'][slot] = {'type': medium_type, 'medium': medium}
+        return ''
+    def _command_createhd(self, positionals: list[str], options: dict[str, str]) -> str:
+        filename = self.__require_option(options = options, name = '--filename')
+        if filename in self.__state['disks']:
+            raise FakeVBoxManageError(f'Medium \'{filename}\' already exists')
+        disk_uuid = str(uuid.uuid4())
+        self.__state['disks'][filename] = {'uuid': disk_uuid, 'size_mb': int(self.__require_option(options = options, name = '--size'))}
+        return f'Medium created. UUID: {disk_uuid}\n'
+    def _command_closemedium(self, positionals: list[str], options: dict[str, str]) -> str:
+        filename = positionals[-1]
+        if filename not in self.__state['disks']:
+            raise FakeVBoxManageError(f'Could not find file for the medium \'{filename}\'')
+        if any(attachment['medium'] == filename for machine in self.__state['machines'].values() for attachment in machine['attachments'].values()):
+            raise FakeVBoxManageError(f'Medium \'{filename}\' is attached to a machine')
+        del self.__state['disks'][filename]
+        return ''
+
+    def _command_startvm(self, positionals: list[str], options: dict[str, str]) -> str:
+        machine = self.__find_machine(name_or_uuid = positionals[0])
+        if machine['state'] == 'running':
+            raise FakeVBoxManageError(f'The machine \'{machine['name']}\' is already locked by a session (or being locked or unlocked)')
+        machine['state'] = 'running'
+        return f'VM "{machine['name']}" has been successfully started.\n'
+    def _command_controlvm(self, positionals: list[str], options: dict[str, str]) -> str:
+        machine = self.__find_machine(name_or_uuid = positionals[0])
+        if positionals[1:2] != ['poweroff']:
+            raise FakeVBoxManageError(f'Unsupported controlvm action {positionals[1:2]}')
+        if machine['state'] not in ('running', 'paused'):
+            raise FakeVBoxManageError(f'Machine \'{machine['name']}\' is not currently running')
+        machine['state'] = 'poweroff'
+        return ''
+    def _command_guestcontrol(self, positionals: list[str], options: dict[str, str]) -> str:
+        machine = self.__find_machine(name_or_uuid = positionals[0])
+        if positionals[1:2] != ['run']:
+            raise FakeVBoxManageError(f'Unsupported guestcontrol action {positionals[1:2]}')
+        if machine['state'] != 'running':
+            raise FakeVBoxManageError(f'Machine \'{machine['name']}\' is not running')
+        self.__require_option(options = options, name = '--exe')
+        # the guest "executes" an echo of its arguments
+        return ' '.join(filter(None, options.get('--', '').split('\0'))) + '\n'
@@ -0,0 +1,131 @@
+from domain.machines.backends import AbstractVBoxManageBackend
+from domain.machines.models import VBoxManageCallResult, VBoxManageOutputEvent
+from domain.validation import validate_call
+import concurrent.futures
+import contextlib
+import pydantic
+import asyncio
+import typing
+
+try:
+    import vboxapi
+except ImportError:
+    vboxapi = None
+
+
+class XpcomVBoxManageBackend(AbstractVBoxManageBackend):
+    # VMState values as printed by `showvminfo --machinereadable`
+    MACHINE_STATES: typing.ClassVar[dict[str, str]] = {
+        'PoweredOff': 'poweroff', 'Saved': 'saved', 'Teleported': 'teleported', 'Aborted': 'aborted', 'AbortedSaved': 'abortedsaved',
+        'Running': 'running', 'Paused': 'paused', 'Stuck': 'gurumeditation', 'Teleporting': 'teleporting', 'LiveSnapshotting': 'livesnapshotting',
+        'Starting': 'starting', 'Stopping': 'stopping', 'Saving': 'saving', 'Restoring': 'restoring',
+    }
+
+    @validate_call(config = pydantic.ConfigDict(arbitrary_types_allowed = True), validate_return = True)
+    def __init__(self, fallback: AbstractVBoxManageBackend) -> None:
+        if vboxapi is None:
+            raise RuntimeError('The vboxapi python binding is not installed')
+        self.__fallback: AbstractVBoxManageBackend = fallback
+        self.__manager = vboxapi.VirtualBoxManager(None, None)
+        self.__vbox = self.__manager.getVirtualBox()
+        self.__states: dict[int, str] = {value: self.MACHINE_STATES.get(name, name.lower()) for (name, value) in self.__manager.constants.all_values('MachineState').items()}
+        # XPCOM has to be initialised on every thread touching it, so a single thread owns all calls, which also keeps them from interleaving
+        self.__executor: concurrent.futures.ThreadPoolExecutor = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'xpcom', initializer = self.__manager.initPerThread)
+
+    @validate_call(validate_return = True)
+    def close(self) -> None:
+        self.__executor.submit(self.__manager.deinitPerThread).result()
+        self.__executor.shutdown()
+        self.__vbox = None
+        self.__manager.deinit()
+        self.__fallback.close()
+
+    @validate_call(validate_return = True)
+    def execute(self, args: list[str]) -> VBoxManageCallResult:
+        if (handler := self.__find_handler(args = args)) is None:
+            return self.__fallback.execute(args = args)
+        return self.__executor.submit(self.__call, handler, args).result()
+    @validate_call(validate_return = True)
+    async def execute_async(self, args: list[str]) -> VBoxManageCallResult:
+        if (handler := self.__find_handler(args = args)) is None:
+            return await self.__fallback.execute_async(args = args)
+        return await asyncio.wrap_future(self.__executor.submit(self.__call, handler, args))
+    async def stream_async(self, args: list[str]) -> typing.AsyncIterator[VBoxManageOutputEvent]:
+        # guest commands are not handled here, keep the fallback's real pipes so that they can be killed on timeout
+        source = super().stream_async(args = args) if self.__find_handler(args = args) is not None else self.__fallback.stream_async(args = args)
+        async with contextlib.aclosing(source) as events:
+            async for event in events:
+                yield event
+
+    def __find_handler(self, args: list[str]) -> typing.Callable[..., str] | None:
+        match args:
+            case ['list', 'vms']:
+                return self.__list_vms
+            case ['list', 'vms', '--long']:
+                return self.__list_vms_long
+            case ['showvminfo', _, '--machinereadable']:
+                return self.__show_vm_info
+            case ['setextradata', _, _, _] | ['setextradata', _, _]:
+                return self.__set_extra_data
+            case ['modifyvm', _, '--vrdeaddress', _, '--vrdeport', _]:
+                return self.__modify_vrde_network
+        # startvm and poweroff wait for a progress of several seconds, the single XPCOM thread would stall every listing meanwhile
+        return None
+    def __call(self, handler: typing.Callable[..., str], args: list[str]) -> VBoxManageCallResult:
+        try:
+            return VBoxManageCallResult(args = ['vboxapi'] + args, status = 0, stdout = handler(*args[1:]), stderr = '')
+        except Exception as error:
+            return VBoxManageCallResult(args = ['vboxapi'] + args, status = 1, stdout = '', stderr = f'VBoxManage: error: {error}\n')
+    def __with_session(self, name_or_uuid: str, lock_type: str, action: typing.Callable[[typing.Any], None]) -> None:
+        session = self.__manager.getSessionObject()
+        self.__vbox.findMachine(name_or_uuid).lockMachine(session, self.__manager.constants.all_values('LockType')[lock_type])
+        try:
+            action(session)
+        finally:
+            session.unlockMachine()
+
+    def __list_vms(self, *args: str) -> str:
+        return ''.join(f'"{machine.name}" {{{machine.id}}}\n' for machine in self.__manager.getArray(self.__vbox, 'machines'))
+    def __list_vms_long(self, *args: str) -> str:
+        # only the subset of fields which the server itself reads, in the layout of `list vms --long`
+        blocks: list[str] = []
+        for machine in self.__manager.getArray(self.__vbox, 'machines'):
+            vrde = 'disabled'
+            if machine.VRDEServer.enabled:
+                vrde = f'enabled (Address {machine.VRDEServer.getVRDEProperty('TCP/Address') or '0.0.0.0'}, Ports {machine.VRDEServer.getVRDEProperty('TCP/Ports')})'
+            lines = [
+                ('Name', machine.name),
+                ('Guest OS', machine.OSTypeId),
+                ('UUID', machine.id),
+                ('Memory size', f'{machine.memorySize}MB'),
+                ('Number of CPUs', machine.CPUCount),
+                ('State', {'poweroff': 'powered off', 'gurumeditation': 'guru meditation', 'abortedsaved': 'aborted-saved', 'livesnapshotting': 'live snapshotting'}.get(state := self.__states.get(machine.state, 'unknown'), state)),
+                ('VRDE', vrde),
+            ]
+            blocks.append(''.join(f'{f'{key}:':<29}{value}\n' for (key, value) in lines))
+        return '\n'.join(blocks)
+    def __show_vm_info(self, name_or_uuid: str, *args: str) -> str:
+        # only the subset of fields which the server itself reads
+        machine = self.__vbox.findMachine(name_or_uuid)
+        lines = [
+            f'name="{machine.name}"',
+            f'UUID="{machine.id}"',
+            f'ostype="{machine.OSTypeId}"',
+            f'memory={machine.memorySize}',
+            f'cpus={machine.CPUCount}',
+            f'VMState="{self.__states.get(machine.state, 'unknown')}"',
+            f'vrde="{'on' if machine.VRDEServer.enabled else 'off'}"',
+            f'vrdeports="{machine.VRDEServer.getVRDEProperty('TCP/Ports')}"',
+            f'vrdeaddress="{machine.VRDEServer.getVRDEProperty('TCP/Address')}"',
+        ]
+        return ''.join(f'{line}\n' for line in lines)
+    def __set_extra_data(self, name_or_uuid: str, key: str, value: str = '') -> str:
+        self.__vbox.findMachine(name_or_uuid).setExtraData(key, value)
+        return ''
+    def __modify_vrde_network(self, name_or_uuid: str, address_option: str, address: str, port_option: str, port: str) -> str:
+        def modify(session: typing.Any) -> None:
+            session.machine.VRDEServer.setVRDEProperty('TCP/Address', address)
+            session.machine.VRDEServer.setVRDEProperty('TCP/Ports', port)
+            session.machine.saveSettings()
+        self.__with_session(name_or_uuid = name_or_uuid, lock_type = 'Write', action = modify)
+        return ''
@@ -0,0 +1,39 @@
+from domain.validation import validate_call
+import collections
+import pydantic
+import typing
+import time
+
+
+class MachineStateCache:
+    @validate_call(validate_return = True)
+    def __init__(self, ttl_ms: pydantic.NonNegativeInt, max_size: pydantic.PositiveInt) -> None:
+        self.__ttl_s: float = ttl_ms / 1000
+        self.__max_size: int = max_size
+        self.__entries: collections.OrderedDict[typing.Hashable, tuple[float, pydantic.BaseModel]] = collections.OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.__ttl_s > 0
+
+    def get(self, key: typing.Hashable) -> pydantic.BaseModel | None:
+        if (entry := self.__entries.get(key)) is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.__entries[key]
+            return None
+        self.__entries.move_to_end(key)
+        # callers are free to mutate what they get back
+        return entry[1].model_copy(deep = True)
+    def put(self, key: typing.Hashable, value: pydantic.BaseModel) -> None:
+        if not self.enabled:
+            return
+        self.__entries[key] = (time.monotonic() + self.__ttl_s, value.model_copy(deep = True))
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.__max_size:
+            self.__entries.popitem(last = False)
+    def invalidate(self, *keys: typing.Hashable) -> None:
+        for key in keys:
+            self.__entries.pop(key, None)
+    def clear(self) -> None:
+        self.__entries.clear()
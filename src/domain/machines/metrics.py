@@ -0,0 +1,29 @@
+from domain.machines.models import VirtualBoxApiError
+from domain.metrics import REGISTRY
+import functools
+import typing
+
+OPERATION_DURATION = REGISTRY.histogram('vbox_server_operation_duration_seconds', 'Duration of VirtualBoxApi operations, cache hits included.', labels = ('operation',))
+OPERATIONS_IN_FLIGHT = REGISTRY.gauge('vbox_server_operations_in_flight', 'VirtualBoxApi operations currently running.', labels = ('operation',))
+OPERATION_ERRORS = REGISTRY.counter('vbox_server_operation_errors_total', 'Failed VirtualBoxApi operations by failing stage and VBoxManage exit code.', labels = ('stage', 'status'))
+STAGE_DURATION = REGISTRY.histogram('vbox_server_stage_duration_seconds', 'Duration of pipeline stages, waiting for a free call slot included.', labels = ('stage',))
+CALL_DURATION = REGISTRY.histogram('vbox_server_vboxmanage_call_duration_seconds', 'Duration of VBoxManage calls by subcommand.', labels = ('subcommand',))
+CALLS_TOTAL = REGISTRY.counter('vbox_server_vboxmanage_calls_total', 'Finished VBoxManage calls by subcommand and exit code.', labels = ('subcommand', 'status'))
+CALLS_IN_FLIGHT = REGISTRY.gauge('vbox_server_vboxmanage_calls_in_flight', 'VBoxManage calls currently executing.')
+CALLS_WAITING = REGISTRY.gauge('vbox_server_vboxmanage_calls_waiting', 'VBoxManage calls waiting for a free call slot.')
+PROCESS_SPAWNS = REGISTRY.counter('vbox_server_vboxmanage_process_spawns_total', 'VBoxManage processes spawned, calls served in-process are not counted.')
+
+def subcommand_of(args: list[str]) -> str:
+    return next((arg for arg in args if not arg.startswith('--')), '')
+
+def instrument_operation[**Params, ResultType](function: typing.Callable[Params, typing.Awaitable[ResultType]]) -> typing.Callable[Params, typing.Awaitable[ResultType]]:
+    @functools.wraps(function)
+    async def wrapper(*args: Params.args, **kwargs: Params.kwargs) -> ResultType:
+        operation = function.__name__
+        with REGISTRY.span(f'vbox_api.{operation}'), OPERATIONS_IN_FLIGHT.track_in_progress(operation = operation), OPERATION_DURATION.time(operation = operation):
+            try:
+                return await function(*args, **kwargs)
+            except VirtualBoxApiError as error:
+                OPERATION_ERRORS.inc(stage = error.stage, status = str(error.error_info.status))
+                raise
+    return wrapper
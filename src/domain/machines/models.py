@@ -1,4 +1,8 @@
+from domain.validation import validate_call
 import pydantic
+import hashlib
+import typing
+import uuid
 
 class RunVmCommand(pydantic.BaseModel):
     username: pydantic.constr(min_length = 1)
@@ -12,20 +16,31 @@ class VBoxManageCallResult(pydantic.BaseModel):
     status: int
     stdout: str
     stderr: str
+    truncated: bool = False
+
+class VBoxManageOutputEvent(pydantic.BaseModel):
+    kind: typing.Literal['stdout', 'stderr', 'exit']
+    data: str = ''
+    # set on the `exit` event only, `None` when the call was killed on the host side
+    status: int | None = None
+    timed_out: bool = False
 
 class LogEntry(pydantic.BaseModel):
     stage: pydantic.constr(min_length = 1) # type: ignore
-    call: VBoxManageCallResult
+    call: VBoxManageCallResult | None = None
 
 class VirtualBoxApiResponse[GenericPayloadType](pydantic.BaseModel):
     payload: GenericPayloadType
     logs: list[LogEntry]
+    operation_id: uuid.UUID | None = None
 
 class VirtualBoxApiError(Exception):
-    @pydantic.validate_call(validate_return = True)
+    @validate_call(validate_return = True)
     def __init__(self, error_info: VBoxManageCallResult, stage: str, message: str = '') -> None:
         self.__error_info: VBoxManageCallResult = error_info
         self.__stage: str = stage
+        # the calls which undid the earlier stages of the failed operation, if any
+        self.__rollback_logs: list[LogEntry] = []
 
     @property
     def error_info(self) -> VBoxManageCallResult:
@@ -33,6 +48,13 @@ class VirtualBoxApiError(Exception):
     @property
     def stage(self) -> str:
         return self.__stage
+    @property
+    def rollback_logs(self) -> list[LogEntry]:
+        return self.__rollback_logs
+
+class NoCleanSnapshotError(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
 
 
 
@@ -48,15 +70,46 @@ class CreateMachineInfo(pydantic.BaseModel):
     class VrdeCredentialsInfo(pydantic.BaseModel):
         username: pydantic.constr(min_length = 1, max_length = 255) # type: ignore
         password: pydantic.constr(min_length = 8, max_length = 255) # type: ignore
+
+        @property
+        def password_sha256(self) -> str:
+            return hashlib.sha256(self.password.encode('utf-8')).hexdigest()
+    class HashedVrdeCredentialsInfo(pydantic.BaseModel):
+        # VBoxAuthSimple only keeps the hash, credentials in this form can be stored without the password
+        username: pydantic.constr(min_length = 1, max_length = 255) # type: ignore
+        password_sha256: pydantic.constr(pattern = r'^[0-9a-f]{64}$') # type: ignore
     class DriveInfo(pydantic.BaseModel):
         size_gb: pydantic.PositiveInt
+    class GoldenTemplateInfo(pydantic.BaseModel):
+        machine: pydantic.constr(min_length = 1) # type: ignore
+        snapshot: pydantic.constr(min_length = 1) # type: ignore
 
     os_type: str
-    template: str
+    template: str | None = None
+    golden_template: GoldenTemplateInfo | None = None
     drive: DriveInfo
     hardware: HardwareInfo
-    vrde_credentials: VrdeCredentialsInfo
+    vrde_credentials: VrdeCredentialsInfo | HashedVrdeCredentialsInfo
+    # taken right after provisioning, `reset_vm` restores it
+    clean_snapshot: bool = False
+
+    @pydantic.model_validator(mode = 'after')
+    def check_machine_source(self) -> 'CreateMachineInfo':
+        if (self.template is None) == (self.golden_template is None):
+            raise ValueError('exactly one of template and golden_template must be set')
+        return self
 
 class FullMachineInfo(pydantic.BaseModel):
     is_online: bool
+    state: str
     vrde_connection: VrdeConnectionInfo
+    cpu_count: pydantic.PositiveInt | None = None
+    memory_mb: pydantic.PositiveInt | None = None
+
+class HardDiskInfo(pydantic.BaseModel):
+    uuid: uuid.UUID
+    # `None` for a base disk, a linked clone writes to a differencing disk on top of the one of its template
+    parent_uuid: uuid.UUID | None = None
+    location: str
+    capacity_mb: pydantic.NonNegativeInt
+    size_on_disk_mb: pydantic.NonNegativeInt
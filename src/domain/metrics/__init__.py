@@ -0,0 +1,149 @@
+import contextlib
+import threading
+import typing
+import math
+import time
+
+type LabelValues = tuple[str, ...]
+type SpanHook = typing.Callable[[str, dict[str, str]], typing.ContextManager[None]]
+
+# prometheus defaults stretched towards the tens of seconds a VBoxManage call can take
+DEFAULT_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Metric:
+    kind: typing.ClassVar[str] = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labels: tuple[str, ...] = labels
+        # observed from the event loop and from backend worker threads alike
+        self._lock: threading.Lock = threading.Lock()
+
+    def _label_values(self, labels: dict[str, str]) -> LabelValues:
+        if labels.keys() != set(self.labels):
+            raise ValueError(f'{self.name} expects labels {self.labels}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labels)
+    def _format_labels(self, values: LabelValues, extra: dict[str, str] | None = None) -> str:
+        pairs = list(zip(self.labels, values)) + list((extra or dict()).items())
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for (_, value) in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for ((name, _), value) in zip(pairs, escaped)) + '}'
+    def _samples(self) -> typing.Iterator[str]:
+        raise NotImplementedError(f'{type(self)}._samples')
+    def render(self) -> str:
+        with self._lock:
+            samples = list(self._samples())
+        return ''.join([f'# HELP {self.name} {self.documentation}\n', f'# TYPE {self.name} {self.kind}\n'] + [f'{sample}\n' for sample in samples])
+
+class Counter(Metric):
+    kind: typing.ClassVar[str] = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name = name, documentation = documentation, labels = labels)
+        # an unlabelled series is exported from the start instead of appearing on first use
+        self.__values: dict[LabelValues, float] = {(): 0} if not labels else dict()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels = labels)
+        with self._lock:
+            self.__values[key] = self.__values.get(key, 0) + amount
+    def _samples(self) -> typing.Iterator[str]:
+        for (key, value) in self.__values.items():
+            yield f'{self.name}{self._format_labels(values = key)} {value}'
+
+class Gauge(Metric):
+    kind: typing.ClassVar[str] = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name = name, documentation = documentation, labels = labels)
+        self.__values: dict[LabelValues, float] = {(): 0} if not labels else dict()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels = labels)
+        with self._lock:
+            self.__values[key] = self.__values.get(key, 0) + amount
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+    @contextlib.contextmanager
+    def track_in_progress(self, **labels: str) -> typing.Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+    def _samples(self) -> typing.Iterator[str]:
+        for (key, value) in self.__values.items():
+            yield f'{self.name}{self._format_labels(values = key)} {value}'
+
+class Histogram(Metric):
+    kind: typing.ClassVar[str] = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name = name, documentation = documentation, labels = labels)
+        self.__buckets: tuple[float, ...] = tuple(sorted(buckets)) + (math.inf,)
+        # per label set: non-cumulative bucket counts, sum and count
+        self.__values: dict[LabelValues, tuple[list[int], list[float]]] = dict()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels = labels)
+        with self._lock:
+            (counts, totals) = self.__values.setdefault(key, ([0] * len(self.__buckets), [0.0, 0]))
+            counts[next(index for (index, bound) in enumerate(self.__buckets) if value <= bound)] += 1
+            totals[0] += value
+            totals[1] += 1
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> typing.Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+    def _samples(self) -> typing.Iterator[str]:
+        for (key, (counts, (total, count))) in self.__values.items():
+            cumulative = 0
+            for (bound, bucket_count) in zip(self.__buckets, counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket{self._format_labels(values = key, extra = {'le': '+Inf' if math.isinf(bound) else repr(float(bound))})} {cumulative}'
+            yield f'{self.name}_sum{self._format_labels(values = key)} {total}'
+            yield f'{self.name}_count{self._format_labels(values = key)} {count}'
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.__metrics: dict[str, Metric] = dict()
+        self.__span_hooks: list[SpanHook] = []
+
+    def __register[MetricType: Metric](self, metric: MetricType) -> MetricType:
+        if metric.name in self.__metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self.__metrics[metric.name] = metric
+        return metric
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.__register(metric = Counter(name = name, documentation = documentation, labels = labels))
+    def gauge(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self.__register(metric = Gauge(name = name, documentation = documentation, labels = labels))
+    def histogram(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.__register(metric = Histogram(name = name, documentation = documentation, labels = labels, buckets = buckets))
+    def render(self) -> str:
+        # prometheus text exposition format 0.0.4
+        return ''.join(metric.render() for metric in self.__metrics.values())
+
+    def add_span_hook(self, hook: SpanHook) -> None:
+        # e.g. `lambda name, attributes: tracer.start_as_current_span(name, attributes = attributes)`
+        self.__span_hooks.append(hook)
+    def remove_span_hook(self, hook: SpanHook) -> None:
+        self.__span_hooks.remove(hook)
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes: str) -> typing.Iterator[None]:
+        if not self.__span_hooks:
+            yield
+            return
+        with contextlib.ExitStack() as stack:
+            for hook in list(self.__span_hooks):
+                stack.enter_context(hook(name, attributes))
+            yield
+
+REGISTRY: MetricsRegistry = MetricsRegistry()
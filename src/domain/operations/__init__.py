@@ -0,0 +1,49 @@
+from domain.machines.models import VirtualBoxApiResponse, LogEntry
+from domain.operations.models import LogVerbosity, OperationLogs
+from domain.validation import validate_call
+import collections
+import pydantic
+import uuid
+
+
+class OperationLogStore:
+    @validate_call(validate_return = True)
+    def __init__(self, max_operations: pydantic.NonNegativeInt = 1024, max_bytes: pydantic.NonNegativeInt = 64 * 1024 * 1024, default_verbosity: LogVerbosity = 'full') -> None:
+        self.__max_operations: int = max_operations
+        self.__max_bytes: int = max_bytes
+        self.__default_verbosity: LogVerbosity = default_verbosity
+        self.__operations: collections.OrderedDict[uuid.UUID, tuple[int, list[LogEntry]]] = collections.OrderedDict()
+        self.__size_bytes: int = 0
+
+    def get(self, operation_id: uuid.UUID) -> OperationLogs | None:
+        if (operation := self.__operations.get(operation_id)) is None:
+            return None
+        return OperationLogs(operation_id = operation_id, logs = operation[1])
+    def record[ResponseType: VirtualBoxApiResponse](self, response: ResponseType, verbosity: LogVerbosity | None = None) -> ResponseType:
+        # the full calls are kept out of band for the most recent operations, oldest ones are dropped first
+        operation_id = None
+        if self.__max_operations > 0 and self.__max_bytes > 0:
+            operation_id = response.operation_id or uuid.uuid4()
+            if operation_id in self.__operations:
+                # a cached response comes back with the id it was first recorded under, its calls are stored once
+                self.__operations.move_to_end(operation_id)
+            elif (size_bytes := self.__size_of(logs = response.logs)) > self.__max_bytes:
+                # an operation which could never fit is not stored, evicting everything else for it would leave the store empty
+                operation_id = None
+            else:
+                self.__operations[operation_id] = (size_bytes, response.logs)
+                self.__size_bytes += size_bytes
+                while len(self.__operations) > self.__max_operations or self.__size_bytes > self.__max_bytes:
+                    self.__size_bytes -= self.__operations.popitem(last = False)[1][0]
+        match verbosity or self.__default_verbosity:
+            case 'none':
+                logs = []
+            case 'stages':
+                logs = [LogEntry(stage = entry.stage) for entry in response.logs]
+            case _:
+                logs = response.logs
+        return response.model_copy(update = {'logs': logs, 'operation_id': operation_id})
+
+    def __size_of(self, logs: list[LogEntry]) -> int:
+        # the captured output dominates, the rest of an entry is counted as a flat overhead
+        return sum(256 + (len(entry.call.stdout) + len(entry.call.stderr) + sum(len(arg) for arg in entry.call.args) if entry.call is not None else 0) for entry in logs)
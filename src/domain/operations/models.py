@@ -0,0 +1,11 @@
+from domain.machines.models import LogEntry
+import pydantic
+import typing
+import uuid
+
+# `stages` keeps the stage names only, the calls stay retrievable by `operation_id`
+LogVerbosity = typing.Literal['none', 'stages', 'full']
+
+class OperationLogs(pydantic.BaseModel):
+    operation_id: uuid.UUID
+    logs: list[LogEntry]
@@ -0,0 +1,94 @@
+from domain.machines.models import VirtualBoxApiResponse, VirtualBoxApiError, CreateMachineInfo
+from domain.configs.models import ConfigName
+from domain.pools.models import PoolSettings
+from domain.configs import AbstractConfigRepository
+from domain.machines import VirtualBoxApi
+from domain.hosts import HostRegistry
+from domain.validation import validate_call
+import collections
+import contextlib
+import pydantic
+import asyncio
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class MachinePoolManager:
+    @validate_call(config = pydantic.ConfigDict(arbitrary_types_allowed = True), validate_return = True)
+    def __init__(self, vbox_api: VirtualBoxApi | HostRegistry, configs: AbstractConfigRepository, settings: dict[ConfigName, PoolSettings], default_settings: PoolSettings = PoolSettings(), refill_interval_s: pydantic.PositiveFloat = 30) -> None:
+        self.__vbox_api: VirtualBoxApi | HostRegistry = vbox_api
+        self.__configs: AbstractConfigRepository = configs
+        self.__settings: dict[str, PoolSettings] = settings
+        self.__default_settings: PoolSettings = default_settings
+        self.__refill_interval_s: float = refill_interval_s
+        # ready machines together with the VRDE username they were provisioned with
+        self.__ready: collections.defaultdict[str, collections.deque[tuple[uuid.UUID, str]]] = collections.defaultdict(collections.deque)
+        self.__provisioning: collections.Counter[str] = collections.Counter()
+        self.__refill_event: asyncio.Event = asyncio.Event()
+        self.__refill_task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        self.__refill_task = asyncio.create_task(self.__run())
+    async def stop(self) -> None:
+        if self.__refill_task is not None:
+            self.__refill_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.__refill_task
+        # nothing outside of this process knows about idle pooled machines, so they are not left behind
+        for ready in self.__ready.values():
+            while ready:
+                with contextlib.suppress(VirtualBoxApiError):
+                    (vm_uuid, _) = ready.popleft()
+                    await self.__vbox_api.stop_vm(vm_uuid = vm_uuid)
+                    await self.__vbox_api.delete_vm(vm_uuid = vm_uuid)
+
+    def ready_count(self, config_name: ConfigName) -> int:
+        return len(self.__ready[config_name])
+    @validate_call(validate_return = True)
+    async def acquire(self, config_name: ConfigName, vrde_credentials: CreateMachineInfo.VrdeCredentialsInfo) -> VirtualBoxApiResponse[uuid.UUID]:
+        machine_info = self.__configs.load_config(config = config_name)
+        try:
+            while self.__ready[config_name]:
+                (vm_uuid, pooled_username) = self.__ready[config_name].popleft()
+                try:
+                    set_vrde_credentials_result = await self.__vbox_api.set_vrde_credentials(vm_uuid = vm_uuid, vrde_credentials = vrde_credentials, previous_username = pooled_username)
+                except VirtualBoxApiError:
+                    logger.warning('pooled machine %s of config %s is gone, skipping it', vm_uuid, config_name)
+                    continue
+                return VirtualBoxApiResponse[uuid.UUID](payload = vm_uuid, logs = set_vrde_credentials_result.logs)
+            # the pool is drained, fall back to a regular provisioning
+            return await self.__vbox_api.create_vm(machine_info = machine_info.model_copy(update = {'vrde_credentials': vrde_credentials}))
+        finally:
+            self.__refill_event.set()
+
+    async def __run(self) -> None:
+        while True:
+            try:
+                await self.__refill()
+            except Exception:
+                logger.exception('machine pool refill failed')
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.__refill_event.wait(), timeout = self.__refill_interval_s)
+            self.__refill_event.clear()
+    async def __refill(self) -> None:
+        provisions = []
+        for config_name in self.__configs.list_configs():
+            settings = self.__settings.get(config_name, self.__default_settings)
+            # refill starts below the low watermark and goes up to the high one
+            if (available := len(self.__ready[config_name]) + self.__provisioning[config_name]) < settings.min_ready:
+                provisions += [self.__provision(config_name = config_name, settings = settings) for _ in range(settings.max_ready - available)]
+        for result in await asyncio.gather(*provisions, return_exceptions = True):
+            if isinstance(result, Exception):
+                logger.error('machine pool provisioning failed', exc_info = result)
+    async def __provision(self, config_name: str, settings: PoolSettings) -> None:
+        self.__provisioning[config_name] += 1
+        try:
+            machine_info = self.__configs.load_config(config = config_name)
+            vm_uuid = (await self.__vbox_api.create_vm(machine_info = machine_info)).payload
+            if settings.boot:
+                await self.__vbox_api.start_vm(vm_uuid = vm_uuid)
+            self.__ready[config_name].append((vm_uuid, machine_info.vrde_credentials.username))
+        finally:
+            self.__provisioning[config_name] -= 1
@@ -0,0 +1,12 @@
+import pydantic
+
+class PoolSettings(pydantic.BaseModel):
+    min_ready: pydantic.NonNegativeInt = 0
+    max_ready: pydantic.NonNegativeInt = 0
+    boot: bool = False
+
+    @pydantic.model_validator(mode = 'after')
+    def check_watermarks(self) -> 'PoolSettings':
+        if self.min_ready > self.max_ready:
+            raise ValueError('min_ready must not be greater than max_ready')
+        return self
@@ -0,0 +1,11 @@
+import pydantic
+import typing
+import os
+
+# the HTTP layer always validates requests and responses, the domain layer may skip re-validating its own calls
+INTERNAL_VALIDATION: bool = os.environ.get('VBOX_SERVER__INTERNAL_VALIDATION', 'on').lower() not in ('0', 'off', 'false', 'no')
+
+def validate_call(**kwargs: typing.Any) -> typing.Callable[[typing.Callable[..., typing.Any]], typing.Callable[..., typing.Any]]:
+    if INTERNAL_VALIDATION:
+        return pydantic.validate_call(**kwargs)
+    return lambda function: function
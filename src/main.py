@@ -1,25 +1,41 @@
 from contextlib import asynccontextmanager
+import presentation.api.v1.operations
+import presentation.api.v1.jobs
+import presentation.api.v1.hosts
 import presentation.api.v1.machines
 import presentation.api.v1.configs
 import presentation.api.v1.images
 import presentation.config
+import presentation.services
 import domain.machines.models
+import domain.hosts.models
+import domain.metrics
 import fastapi.responses
 import fastapi
 import typing
 
 @asynccontextmanager
 async def application_lifespan(app: fastapi.FastAPI) -> typing.Generator[None]:
-    yield print(presentation.config.load_application_config())
+    config = presentation.config.load_application_config()
+    app.state.services = presentation.services.create_application_services(config = config)
+    await app.state.services.start()
+    yield print(config)
+    await app.state.services.stop()
 
 app = fastapi.FastAPI(lifespan = application_lifespan)
 app.include_router(router = presentation.api.v1.machines.router, prefix = '/api/v1')
 app.include_router(router = presentation.api.v1.configs.router, prefix = '/api/v1')
 app.include_router(router = presentation.api.v1.images.router, prefix = '/api/v1')
+app.include_router(router = presentation.api.v1.operations.router, prefix = '/api/v1')
+app.include_router(router = presentation.api.v1.jobs.router, prefix = '/api/v1')
+app.include_router(router = presentation.api.v1.hosts.router, prefix = '/api/v1')
 
 @app.get('/ping')
 async def ping(): 
     return 'OK'
+@app.get('/metrics', response_class = fastapi.responses.PlainTextResponse)
+async def metrics() -> fastapi.responses.PlainTextResponse:
+    return fastapi.responses.PlainTextResponse(content = domain.metrics.REGISTRY.render(), media_type = 'text/plain; version=0.0.4')
 
 @app.exception_handler(domain.machines.models.VirtualBoxApiError)
 async def unicorn_exception_handler(request: fastapi.Request, exc: domain.machines.models.VirtualBoxApiError):
@@ -27,6 +43,13 @@ async def unicorn_exception_handler(request: fastapi.Request, exc: domain.machin
         status_code = 500,
         content = {
             'stage': exc.stage,
-            'call': exc.error_info.model_dump()
+            'call': exc.error_info.model_dump(),
+            'rollback': [entry.model_dump() for entry in exc.rollback_logs],
         },
     )
+@app.exception_handler(domain.machines.models.NoCleanSnapshotError)
+async def no_clean_snapshot_exception_handler(request: fastapi.Request, exc: domain.machines.models.NoCleanSnapshotError):
+    return fastapi.responses.JSONResponse(status_code = 409, content = {'detail': str(exc)})
+@app.exception_handler(domain.hosts.models.NoCapacityError)
+async def no_capacity_exception_handler(request: fastapi.Request, exc: domain.hosts.models.NoCapacityError):
+    return fastapi.responses.JSONResponse(status_code = 503, content = {'detail': str(exc)})
@@ -1,14 +1,12 @@
-import presentation.config
+import presentation.services
 import domain.machines.models
 import domain.configs.models
 import domain.configs
 import fastapi
 import typing
 
-def get_config_repository(config: typing.Annotated[presentation.config.ApplicationConfig, fastapi.Depends(presentation.config.load_application_config)]) -> domain.configs.AbstractConfigRepository:
-    return domain.configs.LocalConfigRepository(
-        configs_dir = config.configs_dir
-    )
+async def get_config_repository(services: typing.Annotated[presentation.services.ApplicationServices, fastapi.Depends(presentation.services.get_application_services)]) -> domain.configs.AbstractConfigRepository:
+    return services.config_repository
 
 
 router = fastapi.APIRouter()
@@ -16,6 +14,9 @@ router = fastapi.APIRouter()
 @router.get('/config')
 async def list_configs(configs: typing.Annotated[domain.configs.AbstractConfigRepository, fastapi.Depends(get_config_repository)]) -> list[domain.configs.models.ConfigName]:
     return configs.list_configs()
+@router.get('/config_info')
+async def list_config_infos(configs: typing.Annotated[domain.configs.AbstractConfigRepository, fastapi.Depends(get_config_repository)]) -> list[domain.configs.models.ConfigInfo]:
+    return configs.list_config_infos()
 
 @router.get('/config/{config_name}')
 async def load_config(configs: typing.Annotated[domain.configs.AbstractConfigRepository, fastapi.Depends(get_config_repository)], config_name: typing.Annotated[domain.configs.models.ConfigName, fastapi.Path()]) -> domain.machines.models.CreateMachineInfo:
@@ -0,0 +1,14 @@
+import presentation.services
+import domain.hosts.models
+import domain.hosts
+import fastapi
+import typing
+
+
+router = fastapi.APIRouter()
+
+@router.get('/host')
+async def list_hosts(services: typing.Annotated[presentation.services.ApplicationServices, fastapi.Depends(presentation.services.get_application_services)]) -> list[domain.hosts.models.HostInfo]:
+    if not isinstance(services.vbox_api, domain.hosts.HostRegistry):
+        raise fastapi.HTTPException(status_code = 404, detail = 'The server drives a single local host, VBOX_SERVER__HOSTS is not set')
+    return await services.vbox_api.list_hosts()
@@ -1,13 +1,11 @@
-import presentation.config
+import presentation.services
 import domain.images.models
 import domain.images
 import fastapi
 import typing
 
-def get_image_repository(config: typing.Annotated[presentation.config.ApplicationConfig, fastapi.Depends(presentation.config.load_application_config)]) -> domain.images.AbstractImageRepository:
-    return domain.images.LocalImageRepository(
-        images_dir = config.images_dir
-    )
+async def get_image_repository(services: typing.Annotated[presentation.services.ApplicationServices, fastapi.Depends(presentation.services.get_application_services)]) -> domain.images.AbstractImageRepository:
+    return services.image_repository
 
 
 router = fastapi.APIRouter()
@@ -15,3 +13,6 @@ router = fastapi.APIRouter()
 @router.get('/image', response_model = list[domain.images.models.ImageName])
 async def list_images(images: typing.Annotated[domain.images.AbstractImageRepository, fastapi.Depends(get_image_repository)]) -> list[domain.images.models.ImageName]:
     return images.list_images()
+@router.get('/image_info', response_model = list[domain.images.models.ImageInfo])
+async def list_image_infos(images: typing.Annotated[domain.images.AbstractImageRepository, fastapi.Depends(get_image_repository)], with_hash: typing.Annotated[bool, fastapi.Query()] = False) -> list[domain.images.models.ImageInfo]:
+    return images.list_image_infos(with_hash = with_hash)
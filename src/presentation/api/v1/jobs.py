@@ -0,0 +1,32 @@
+import presentation.services
+import domain.jobs.models
+import fastapi.responses
+import domain.jobs
+import fastapi
+import typing
+import uuid
+
+async def get_job_queue(services: typing.Annotated[presentation.services.ApplicationServices, fastapi.Depends(presentation.services.get_application_services)]) -> domain.jobs.JobQueue:
+    return services.job_queue
+
+async def get_job_priority(prefer: typing.Annotated[str | None, fastapi.Header()] = None, job_priority: typing.Annotated[int, fastapi.Query()] = 0) -> int | None:
+    # `Prefer: respond-async` (RFC 7240) turns the request into a job, `None` keeps it synchronous
+    if prefer is None or 'respond-async' not in {token.strip().lower() for token in prefer.replace(';', ',').split(',')}:
+        return None
+    return job_priority
+
+def accepted(job: domain.jobs.models.JobInfo) -> fastapi.responses.JSONResponse:
+    return fastapi.responses.JSONResponse(
+        status_code = 202,
+        content = job.model_dump(mode = 'json'),
+        headers = {'Location': f'/api/v1/jobs/{job.id}', 'Preference-Applied': 'respond-async'},
+    )
+
+
+router = fastapi.APIRouter()
+
+@router.get('/jobs/{job_id}')
+async def get_job(job_queue: typing.Annotated[domain.jobs.JobQueue, fastapi.Depends(get_job_queue)], job_id: typing.Annotated[uuid.UUID, fastapi.Path()], wait_s: typing.Annotated[float, fastapi.Query(ge = 0, le = 60)] = 0) -> domain.jobs.models.JobInfo:
+    if (job := await job_queue.wait(job_id = job_id, timeout_s = wait_s)) is None:
+        raise fastapi.HTTPException(status_code = 404, detail = f'Job {job_id} does not exist')
+    return job
@@ -1,41 +1,93 @@
-import presentation.config
+import presentation.api.v1.operations
+import presentation.api.v1.jobs
+import presentation.services
 import domain.machines.models
+import domain.events.models
+import domain.configs.models
+import domain.jobs.models
 import domain.machines
+import domain.events
+import domain.hosts
+import domain.jobs
+import domain.pools
+import fastapi.responses
 import fastapi
 import typing
 import uuid
 
-def get_vboxapi(config: typing.Annotated[presentation.config.ApplicationConfig, fastapi.Depends(presentation.config.load_application_config)]) -> domain.machines.VirtualBoxApi:
-    return domain.machines.VirtualBoxApi(
-        advertised_host = config.advertised_host,
-        machines_dir = config.machines_dir,
-        storages_dir = config.storages_dir,
-        images_dir = config.images_dir,
-    )
+async def get_vboxapi(services: typing.Annotated[presentation.services.ApplicationServices, fastapi.Depends(presentation.services.get_application_services)]) -> domain.machines.VirtualBoxApi | domain.hosts.HostRegistry:
+    return services.vbox_api
+
+async def get_machine_pools(services: typing.Annotated[presentation.services.ApplicationServices, fastapi.Depends(presentation.services.get_application_services)]) -> domain.pools.MachinePoolManager:
+    return services.machine_pools
+
+async def get_machine_watcher(services: typing.Annotated[presentation.services.ApplicationServices, fastapi.Depends(presentation.services.get_application_services)]) -> domain.events.MachineStateWatcher:
+    return services.machine_watcher
+
+async def use_machine_cache(cache_control: typing.Annotated[str | None, fastapi.Header()] = None) -> bool:
+    return cache_control is None or not {'no-cache', 'no-store', 'max-age=0'} & {directive.strip().lower() for directive in cache_control.split(',')}
 
 
 router = fastapi.APIRouter()
 
 @router.get('/machine', response_model = domain.machines.models.VirtualBoxApiResponse[list[uuid.UUID]])
-def list_vms(vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)]) -> domain.machines.models.VirtualBoxApiResponse[list[uuid.UUID]]:
-    return vbox_api.list_vms()
+async def list_vms(record: typing.Annotated[presentation.api.v1.operations.OperationRecorder, fastapi.Depends(presentation.api.v1.operations.get_operation_recorder)], vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], use_cache: typing.Annotated[bool, fastapi.Depends(use_machine_cache)]) -> domain.machines.models.VirtualBoxApiResponse[list[uuid.UUID]]:
+    return record(response = await vbox_api.list_vms(use_cache = use_cache))
+@router.get('/machine/info', response_model = domain.machines.models.VirtualBoxApiResponse[dict[uuid.UUID, domain.machines.models.FullMachineInfo]])
+async def list_vms_info(record: typing.Annotated[presentation.api.v1.operations.OperationRecorder, fastapi.Depends(presentation.api.v1.operations.get_operation_recorder)], vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], use_cache: typing.Annotated[bool, fastapi.Depends(use_machine_cache)], state: typing.Annotated[list[str] | None, fastapi.Query()] = None) -> domain.machines.models.VirtualBoxApiResponse[dict[uuid.UUID, domain.machines.models.FullMachineInfo]]:
+    return record(response = await vbox_api.list_vms_info(states = set(state) if state is not None else None, use_cache = use_cache))
+@router.get('/machine/events', response_class = fastapi.responses.StreamingResponse)
+async def watch_vms(machine_watcher: typing.Annotated[domain.events.MachineStateWatcher, fastapi.Depends(get_machine_watcher)], machine_uuid: typing.Annotated[uuid.UUID | None, fastapi.Query()] = None) -> fastapi.responses.StreamingResponse:
+    # server-sent events: the current state of the watched machines, then every change, a `null` state is a machine that is gone
+    async def events() -> typing.AsyncIterator[str]:
+        async for event in machine_watcher.subscribe(vm_uuid = machine_uuid):
+            yield f'event: state\ndata: {event.model_dump_json()}\n\n'
+    return fastapi.responses.StreamingResponse(content = events(), media_type = 'text/event-stream', headers = {'Cache-Control': 'no-store'})
+@router.get('/machine/{machine_uuid}/state')
+async def wait_for_vm_state(machine_watcher: typing.Annotated[domain.events.MachineStateWatcher, fastapi.Depends(get_machine_watcher)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()], until: typing.Annotated[list[str] | None, fastapi.Query()] = None, wait_s: typing.Annotated[float, fastapi.Query(ge = 0, le = 60)] = 0) -> domain.events.models.MachineStateEvent:
+    # without `until` the request returns on the next change of the state
+    if (event := await machine_watcher.wait_for_state(vm_uuid = machine_uuid, states = set(until) if until is not None else None, timeout_s = wait_s)).state is None:
+        raise fastapi.HTTPException(status_code = 404, detail = f'Machine {machine_uuid} does not exist')
+    return event
 @router.get('/machine/{machine_uuid}', response_model = domain.machines.models.VirtualBoxApiResponse[domain.machines.models.FullMachineInfo])
-def vm_info(vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()]) -> domain.machines.models.VirtualBoxApiResponse[domain.machines.models.FullMachineInfo]:
-    return vbox_api.vm_info(vm_uuid = machine_uuid)
+async def vm_info(record: typing.Annotated[presentation.api.v1.operations.OperationRecorder, fastapi.Depends(presentation.api.v1.operations.get_operation_recorder)], vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], use_cache: typing.Annotated[bool, fastapi.Depends(use_machine_cache)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()]) -> domain.machines.models.VirtualBoxApiResponse[domain.machines.models.FullMachineInfo]:
+    return record(response = await vbox_api.vm_info(vm_uuid = machine_uuid, use_cache = use_cache))
 
-@router.post('/machine', response_model = domain.machines.models.VirtualBoxApiResponse[uuid.UUID])
-def create_vm(vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_info: typing.Annotated[domain.machines.models.CreateMachineInfo, fastapi.Body()]) -> domain.machines.models.VirtualBoxApiResponse[uuid.UUID]:
-    return vbox_api.create_vm(machine_info = machine_info)
-@router.delete('/machine/{machine_uuid}', response_model = domain.machines.models.VirtualBoxApiResponse[None])
-def delete_vm(vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()]) -> domain.machines.models.VirtualBoxApiResponse[None]:
-    return vbox_api.delete_vm(vm_uuid = machine_uuid)
+@router.post('/machine', response_model = domain.machines.models.VirtualBoxApiResponse[uuid.UUID], responses = {202: {'model': domain.jobs.models.JobInfo}})
+async def create_vm(job_queue: typing.Annotated[domain.jobs.JobQueue, fastapi.Depends(presentation.api.v1.jobs.get_job_queue)], job_priority: typing.Annotated[int | None, fastapi.Depends(presentation.api.v1.jobs.get_job_priority)], record: typing.Annotated[presentation.api.v1.operations.OperationRecorder, fastapi.Depends(presentation.api.v1.operations.get_operation_recorder)], vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_info: typing.Annotated[domain.machines.models.CreateMachineInfo, fastapi.Body()]) -> domain.machines.models.VirtualBoxApiResponse[uuid.UUID]:
+    if job_priority is not None:
+        return presentation.api.v1.jobs.accepted(job = job_queue.submit_create_vm(machine_info = machine_info, priority = job_priority))
+    return record(response = await vbox_api.create_vm(machine_info = machine_info))
+@router.post('/machine/from-config/{config_name}', response_model = domain.machines.models.VirtualBoxApiResponse[uuid.UUID])
+async def create_vm_from_config(record: typing.Annotated[presentation.api.v1.operations.OperationRecorder, fastapi.Depends(presentation.api.v1.operations.get_operation_recorder)], machine_pools: typing.Annotated[domain.pools.MachinePoolManager, fastapi.Depends(get_machine_pools)], config_name: typing.Annotated[domain.configs.models.ConfigName, fastapi.Path()], vrde_credentials: typing.Annotated[domain.machines.models.CreateMachineInfo.VrdeCredentialsInfo, fastapi.Body()]) -> domain.machines.models.VirtualBoxApiResponse[uuid.UUID]:
+    return record(response = await machine_pools.acquire(config_name = config_name, vrde_credentials = vrde_credentials))
+@router.delete('/machine/{machine_uuid}', response_model = domain.machines.models.VirtualBoxApiResponse[None], responses = {202: {'model': domain.jobs.models.JobInfo}})
+async def delete_vm(job_queue: typing.Annotated[domain.jobs.JobQueue, fastapi.Depends(presentation.api.v1.jobs.get_job_queue)], job_priority: typing.Annotated[int | None, fastapi.Depends(presentation.api.v1.jobs.get_job_priority)], record: typing.Annotated[presentation.api.v1.operations.OperationRecorder, fastapi.Depends(presentation.api.v1.operations.get_operation_recorder)], vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()]) -> domain.machines.models.VirtualBoxApiResponse[None]:
+    if job_priority is not None:
+        return presentation.api.v1.jobs.accepted(job = job_queue.submit_delete_vm(vm_uuid = machine_uuid, priority = job_priority))
+    return record(response = await vbox_api.delete_vm(vm_uuid = machine_uuid))
 
 @router.post('/machine/{machine_uuid}/run_command', response_model = domain.machines.models.VirtualBoxApiResponse[None])
-def run_vm_command(vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()], run_vm_command: typing.Annotated[domain.machines.models.RunVmCommand, fastapi.Body()]) -> domain.machines.models.VirtualBoxApiResponse[None]:
-    return vbox_api.run_vm_command(vm_uuid = machine_uuid, run_vm_command_info = run_vm_command)
-@router.post('/machine/{machine_uuid}/start', response_model = domain.machines.models.VirtualBoxApiResponse[domain.machines.models.VrdeConnectionInfo])
-def start_vm(vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()]) -> domain.machines.models.VirtualBoxApiResponse[None]:
-    return vbox_api.start_vm(vm_uuid = machine_uuid)
+async def run_vm_command(record: typing.Annotated[presentation.api.v1.operations.OperationRecorder, fastapi.Depends(presentation.api.v1.operations.get_operation_recorder)], vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()], run_vm_command: typing.Annotated[domain.machines.models.RunVmCommand, fastapi.Body()]) -> domain.machines.models.VirtualBoxApiResponse[None]:
+    return record(response = await vbox_api.run_vm_command(vm_uuid = machine_uuid, run_vm_command_info = run_vm_command))
+@router.post('/machine/{machine_uuid}/run_command/stream', response_class = fastapi.responses.StreamingResponse)
+async def stream_vm_command(vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()], run_vm_command: typing.Annotated[domain.machines.models.RunVmCommand, fastapi.Body()]) -> fastapi.responses.StreamingResponse:
+    # server-sent events: `stdout` and `stderr` chunks as they arrive, then a single `exit`
+    async def events() -> typing.AsyncIterator[str]:
+        async for event in vbox_api.stream_vm_command(vm_uuid = machine_uuid, run_vm_command_info = run_vm_command):
+            yield f'event: {event.kind}\ndata: {event.model_dump_json()}\n\n'
+    return fastapi.responses.StreamingResponse(content = events(), media_type = 'text/event-stream', headers = {'Cache-Control': 'no-store'})
+@router.post('/machine/{machine_uuid}/start', response_model = domain.machines.models.VirtualBoxApiResponse[domain.machines.models.VrdeConnectionInfo], responses = {202: {'model': domain.jobs.models.JobInfo}})
+async def start_vm(job_queue: typing.Annotated[domain.jobs.JobQueue, fastapi.Depends(presentation.api.v1.jobs.get_job_queue)], job_priority: typing.Annotated[int | None, fastapi.Depends(presentation.api.v1.jobs.get_job_priority)], record: typing.Annotated[presentation.api.v1.operations.OperationRecorder, fastapi.Depends(presentation.api.v1.operations.get_operation_recorder)], vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()]) -> domain.machines.models.VirtualBoxApiResponse[None]:
+    if job_priority is not None:
+        return presentation.api.v1.jobs.accepted(job = job_queue.submit_start_vm(vm_uuid = machine_uuid, priority = job_priority))
+    return record(response = await vbox_api.start_vm(vm_uuid = machine_uuid))
 @router.post('/machine/{machine_uuid}/stop', response_model = domain.machines.models.VirtualBoxApiResponse[None])
-def stop_vm(vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()]) -> domain.machines.models.VirtualBoxApiResponse[None]:
-    return vbox_api.stop_vm(vm_uuid = machine_uuid)
+async def stop_vm(record: typing.Annotated[presentation.api.v1.operations.OperationRecorder, fastapi.Depends(presentation.api.v1.operations.get_operation_recorder)], vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()]) -> domain.machines.models.VirtualBoxApiResponse[None]:
+    return record(response = await vbox_api.stop_vm(vm_uuid = machine_uuid))
+@router.post('/machine/{machine_uuid}/snapshot', response_model = domain.machines.models.VirtualBoxApiResponse[None])
+async def take_clean_snapshot(record: typing.Annotated[presentation.api.v1.operations.OperationRecorder, fastapi.Depends(presentation.api.v1.operations.get_operation_recorder)], vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()]) -> domain.machines.models.VirtualBoxApiResponse[None]:
+    return record(response = await vbox_api.take_clean_snapshot(vm_uuid = machine_uuid))
+@router.post('/machine/{machine_uuid}/reset', response_model = domain.machines.models.VirtualBoxApiResponse[domain.machines.models.VrdeConnectionInfo | None])
+async def reset_vm(record: typing.Annotated[presentation.api.v1.operations.OperationRecorder, fastapi.Depends(presentation.api.v1.operations.get_operation_recorder)], vbox_api: typing.Annotated[domain.machines.VirtualBoxApi, fastapi.Depends(get_vboxapi)], machine_uuid: typing.Annotated[uuid.UUID, fastapi.Path()], start: typing.Annotated[bool, fastapi.Query()] = False) -> domain.machines.models.VirtualBoxApiResponse[domain.machines.models.VrdeConnectionInfo | None]:
+    return record(response = await vbox_api.reset_vm(vm_uuid = machine_uuid, start = start))
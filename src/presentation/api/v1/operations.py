@@ -0,0 +1,25 @@
+import domain.operations.models
+import presentation.services
+import domain.machines.models
+import domain.operations
+import functools
+import fastapi
+import typing
+import uuid
+
+type OperationRecorder = typing.Callable[[domain.machines.models.VirtualBoxApiResponse], domain.machines.models.VirtualBoxApiResponse]
+
+async def get_operation_logs(services: typing.Annotated[presentation.services.ApplicationServices, fastapi.Depends(presentation.services.get_application_services)]) -> domain.operations.OperationLogStore:
+    return services.operation_logs
+
+async def get_operation_recorder(operation_logs: typing.Annotated[domain.operations.OperationLogStore, fastapi.Depends(get_operation_logs)], log_verbosity: typing.Annotated[domain.operations.models.LogVerbosity | None, fastapi.Query()] = None) -> OperationRecorder:
+    return functools.partial(operation_logs.record, verbosity = log_verbosity)
+
+
+router = fastapi.APIRouter()
+
+@router.get('/operation/{operation_id}/logs')
+async def get_logs(operation_logs: typing.Annotated[domain.operations.OperationLogStore, fastapi.Depends(get_operation_logs)], operation_id: typing.Annotated[uuid.UUID, fastapi.Path()]) -> domain.operations.models.OperationLogs:
+    if (logs := operation_logs.get(operation_id = operation_id)) is None:
+        raise fastapi.HTTPException(status_code = 404, detail = f'Logs of operation {operation_id} are not available')
+    return logs
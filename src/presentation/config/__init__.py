@@ -1,14 +1,50 @@
+import domain.operations.models
+import domain.configs.models
+import domain.hosts.models
+import domain.pools.models
+import domain.validation
 import functools
 import pydantic
 import typing
+import json
 import os
 
+class HostConfig(pydantic.BaseModel):
+    advertised_host: str
+    vbox_backend: typing.Literal['subprocess', 'xpcom', 'fake'] = 'subprocess'
+    vboxmanage_bin: str = 'VBoxManage'
+    # paths as seen by the host's VBoxManage, the application wide ones when not set
+    machines_dir: str | None = None
+    storages_dir: str | None = None
+    images_dir: str | None = None
+    capacity: domain.hosts.models.HostCapacity
+
 class ApplicationConfig(pydantic.BaseModel):
     advertised_host: str
     machines_dir: str
     storages_dir: str
     configs_dir: str
     images_dir: str
+    vbox_backend: typing.Literal['subprocess', 'xpcom', 'fake'] = 'subprocess'
+    vboxmanage_bin: str = 'VBoxManage'
+    max_concurrent_calls: pydantic.PositiveInt = 16
+    machine_cache_ttl_ms: pydantic.NonNegativeInt = 1000
+    machine_cache_max_size: pydantic.PositiveInt = 4096
+    command_output_limit_bytes: pydantic.PositiveInt = 1024 * 1024
+    command_timeout_grace_ms: pydantic.NonNegativeInt = 10000
+    log_verbosity: domain.operations.models.LogVerbosity = 'full'
+    operation_log_max_entries: pydantic.NonNegativeInt = 1024
+    operation_log_max_bytes: pydantic.NonNegativeInt = 64 * 1024 * 1024
+    jobs_database: str
+    job_workers: pydantic.PositiveInt = 4
+    job_retention_s: pydantic.PositiveFloat = 24 * 60 * 60
+    machine_watch_interval_ms: pydantic.PositiveInt = 1000
+    hosts: dict[domain.hosts.models.HostName, HostConfig] = dict()
+    pools: dict[domain.configs.models.ConfigName, domain.pools.models.PoolSettings] = dict()
+    default_pool: domain.pools.models.PoolSettings = domain.pools.models.PoolSettings()
+    pool_refill_interval_s: pydantic.PositiveFloat = 30
+    directory_refresh_interval_s: pydantic.NonNegativeFloat = 1
+    internal_validation: bool = True
 
 @functools.lru_cache(maxsize = 1, typed = 1)
 @pydantic.validate_call(validate_return = True)
@@ -19,4 +55,25 @@ def load_application_config() -> ApplicationConfig:
         storages_dir = os.environ['VBOX_SERVER__STORAGES_DIR'],
         configs_dir = os.environ['VBOX_SERVER__CONFIGS_DIR'],
         images_dir = os.environ['VBOX_SERVER__IMAGES_DIR'],
+        vbox_backend = os.environ.get('VBOX_SERVER__VBOX_BACKEND', 'subprocess'),
+        vboxmanage_bin = os.environ.get('VBOX_SERVER__VBOXMANAGE_BIN', 'VBoxManage'),
+        max_concurrent_calls = os.environ.get('VBOX_SERVER__MAX_CONCURRENT_CALLS', 16),
+        machine_cache_ttl_ms = os.environ.get('VBOX_SERVER__MACHINE_CACHE_TTL_MS', 1000),
+        machine_cache_max_size = os.environ.get('VBOX_SERVER__MACHINE_CACHE_MAX_SIZE', 4096),
+        command_output_limit_bytes = os.environ.get('VBOX_SERVER__COMMAND_OUTPUT_LIMIT_BYTES', 1024 * 1024),
+        command_timeout_grace_ms = os.environ.get('VBOX_SERVER__COMMAND_TIMEOUT_GRACE_MS', 10000),
+        log_verbosity = os.environ.get('VBOX_SERVER__LOG_VERBOSITY', 'full'),
+        operation_log_max_entries = os.environ.get('VBOX_SERVER__OPERATION_LOG_MAX_ENTRIES', 1024),
+        operation_log_max_bytes = os.environ.get('VBOX_SERVER__OPERATION_LOG_MAX_BYTES', 64 * 1024 * 1024),
+        jobs_database = os.environ.get('VBOX_SERVER__JOBS_DATABASE', os.path.join(os.environ['VBOX_SERVER__MACHINES_DIR'], 'jobs.sqlite3')),
+        job_workers = os.environ.get('VBOX_SERVER__JOB_WORKERS', 4),
+        job_retention_s = os.environ.get('VBOX_SERVER__JOB_RETENTION_S', 24 * 60 * 60),
+        machine_watch_interval_ms = os.environ.get('VBOX_SERVER__MACHINE_WATCH_INTERVAL_MS', 1000),
+        hosts = json.loads(os.environ.get('VBOX_SERVER__HOSTS', '{}')),
+        pools = json.loads(os.environ.get('VBOX_SERVER__POOLS', '{}')),
+        default_pool = json.loads(os.environ.get('VBOX_SERVER__DEFAULT_POOL', '{}')),
+        pool_refill_interval_s = os.environ.get('VBOX_SERVER__POOL_REFILL_INTERVAL_S', 30),
+        directory_refresh_interval_s = os.environ.get('VBOX_SERVER__DIRECTORY_REFRESH_INTERVAL_S', 1),
+        # read once at import time by domain.validation, the decorators are applied while the modules load
+        internal_validation = domain.validation.INTERNAL_VALIDATION,
     )
@@ -0,0 +1,98 @@
+import domain.machines.backends.xpcom
+import domain.machines.backends.fake
+import domain.machines.backends
+import domain.operations
+import domain.events
+import domain.hosts
+import domain.jobs
+import presentation.config
+import domain.machines
+import domain.configs
+import domain.images
+import domain.pools
+import pydantic
+import fastapi
+
+class ApplicationServices(pydantic.BaseModel):
+    model_config = pydantic.ConfigDict(arbitrary_types_allowed = True, frozen = True)
+
+    vbox_backends: list[domain.machines.backends.AbstractVBoxManageBackend]
+    vbox_api: domain.machines.VirtualBoxApi | domain.hosts.HostRegistry
+    config_repository: domain.configs.AbstractConfigRepository
+    image_repository: domain.images.AbstractImageRepository
+    machine_pools: domain.pools.MachinePoolManager
+    operation_logs: domain.operations.OperationLogStore
+    job_queue: domain.jobs.JobQueue
+    machine_watcher: domain.events.MachineStateWatcher
+
+    async def start(self) -> None:
+        self.machine_pools.start()
+        self.job_queue.start()
+        self.machine_watcher.start()
+    async def stop(self) -> None:
+        await self.machine_watcher.stop()
+        await self.job_queue.stop()
+        await self.machine_pools.stop()
+        for vbox_backend in self.vbox_backends:
+            vbox_backend.close()
+        self.image_repository.close()
+        self.config_repository.close()
+
+def create_vbox_backend(vbox_backend: str, vboxmanage_bin: str) -> domain.machines.backends.AbstractVBoxManageBackend:
+    subprocess_backend = domain.machines.backends.SubprocessVBoxManageBackend(vboxmanage_bin = vboxmanage_bin)
+    match vbox_backend:
+        case 'xpcom':
+            return domain.machines.backends.xpcom.XpcomVBoxManageBackend(fallback = subprocess_backend)
+        case 'fake':
+            return domain.machines.backends.fake.FakeVBoxManageBackend()
+    return subprocess_backend
+
+def create_vbox_api(config: presentation.config.ApplicationConfig, backend: domain.machines.backends.AbstractVBoxManageBackend, advertised_host: str, machines_dir: str | None = None, storages_dir: str | None = None, images_dir: str | None = None) -> domain.machines.VirtualBoxApi:
+    return domain.machines.VirtualBoxApi(
+        advertised_host = advertised_host,
+        machines_dir = machines_dir or config.machines_dir,
+        storages_dir = storages_dir or config.storages_dir,
+        images_dir = images_dir or config.images_dir,
+        backend = backend,
+        max_concurrent_calls = config.max_concurrent_calls,
+        cache_ttl_ms = config.machine_cache_ttl_ms,
+        cache_max_size = config.machine_cache_max_size,
+        command_output_limit_bytes = config.command_output_limit_bytes,
+        command_timeout_grace_ms = config.command_timeout_grace_ms,
+    )
+
+def create_application_services(config: presentation.config.ApplicationConfig) -> ApplicationServices:
+    # everything here lives as long as the application, requests only look the instances up
+    if config.hosts:
+        vbox_backends = {name: create_vbox_backend(vbox_backend = host.vbox_backend, vboxmanage_bin = host.vboxmanage_bin) for (name, host) in config.hosts.items()}
+        vbox_api = domain.hosts.HostRegistry(
+            hosts = {
+                name: create_vbox_api(config = config, backend = vbox_backends[name], advertised_host = host.advertised_host, machines_dir = host.machines_dir, storages_dir = host.storages_dir, images_dir = host.images_dir)
+                for (name, host) in config.hosts.items()
+            },
+            capacities = {name: host.capacity for (name, host) in config.hosts.items()},
+        )
+    else:
+        # a single local host, there is no capacity to schedule against
+        vbox_backends = {'local': create_vbox_backend(vbox_backend = config.vbox_backend, vboxmanage_bin = config.vboxmanage_bin)}
+        vbox_api = create_vbox_api(config = config, backend = vbox_backends['local'], advertised_host = config.advertised_host)
+    config_repository = domain.configs.LocalConfigRepository(configs_dir = config.configs_dir, refresh_interval_s = config.directory_refresh_interval_s)
+    return ApplicationServices(
+        vbox_backends = list(vbox_backends.values()),
+        vbox_api = vbox_api,
+        config_repository = config_repository,
+        image_repository = domain.images.LocalImageRepository(images_dir = config.images_dir, refresh_interval_s = config.directory_refresh_interval_s),
+        machine_pools = domain.pools.MachinePoolManager(
+            vbox_api = vbox_api,
+            configs = config_repository,
+            settings = config.pools,
+            default_settings = config.default_pool,
+            refill_interval_s = config.pool_refill_interval_s,
+        ),
+        operation_logs = domain.operations.OperationLogStore(max_operations = config.operation_log_max_entries, max_bytes = config.operation_log_max_bytes, default_verbosity = config.log_verbosity),
+        job_queue = domain.jobs.JobQueue(vbox_api = vbox_api, database_path = config.jobs_database, workers = config.job_workers, retention_s = config.job_retention_s),
+        machine_watcher = domain.events.MachineStateWatcher(vbox_api = vbox_api, interval_s = config.machine_watch_interval_ms / 1000),
+    )
+
+async def get_application_services(request: fastapi.Request) -> ApplicationServices:
+    return request.app.state.services